@@ -1,4 +1,9 @@
 from .json import abc2db_json
 from .memory import abc2db_memory
+from .sqlite import abc2db_sqlite
+from .sharded_json import abc2db_sharded_json
+from .mmap import abc2db_mmap, build_mmap
 from .async_json import abc2db_async_json
 from .async_memory import abc2db_async_memory
+from .async_sqlite import abc2db_async_sqlite
+from .cache import abc2db_cached
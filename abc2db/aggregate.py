@@ -0,0 +1,206 @@
+import re
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+
+from .index import sort_value
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+AGGREGATES = ('sum', 'min', 'max', 'avg')
+PREFIXES = tuple(f'{i}_' for i in AGGREGATES) + ('group_count_by_',)
+
+DTYPES = {
+    bool: 'bool',
+    int: 'int64',
+    float: 'float64',
+}
+SCALARS = (bool, int, float, str)
+
+
+def field_type(model: type[BaseModel], key: str, types: tuple) -> type:
+    field = model.__fields__.get(key)
+    if field is None:
+        raise ValueError(f'{model.__name__} has no field {key!r}')
+    if field.shape != SHAPE_SINGLETON or field.type_ not in types:
+        raise ValueError(f'{model.__name__}.{key} is not one of {", ".join(i.__name__ for i in types)}')
+    return field.type_
+
+
+class Aggregate:
+    def __init__(self, model: type[BaseModel], func: str, key: [str] = None, by_key: [str] = None):
+        self.func = func
+        self.key = key
+        self.by_key = by_key
+        self.type = int if key is None else field_type(model, key, tuple(DTYPES))
+        self.by_type = None if by_key is None else field_type(model, by_key, SCALARS)
+
+    def cast(self, value):
+        if value is None:
+            return None
+        if self.func == 'avg':
+            return float(value)
+        if self.func == 'count' or (self.func == 'sum' and self.type is bool):
+            return int(value)
+        return self.type(value)
+
+    def reduce_values(self, values: list):
+        if self.func == 'count':
+            return len(values)
+        values = [i for i in values if i is not None]
+        if self.func == 'sum':
+            return self.cast(sum(values))
+        if not values:
+            return None
+        if self.func == 'min':
+            return self.cast(min(values))
+        if self.func == 'max':
+            return self.cast(max(values))
+        return self.cast(sum(values) / len(values))
+
+    def reduce(self, models) -> dict:
+        if self.by_key is None:
+            return self.reduce_values([getattr(i, self.key) for i in models])
+        groups = {}
+        for i in models:
+            groups.setdefault(getattr(i, self.by_key), []).append(self.key and getattr(i, self.key))
+        return {k: self.reduce_values(groups[k]) for k in sorted(groups, key=sort_value)}
+
+    def reduce_array(self, values):
+        if self.func == 'sum':
+            return self.cast(values.sum())
+        if not len(values):
+            return None
+        if self.func == 'min':
+            return self.cast(values.min())
+        if self.func == 'max':
+            return self.cast(values.max())
+        return self.cast(values.mean())
+
+    def group_array(self, codes, size: int, values, present):
+        if self.func == 'count':
+            return numpy.bincount(codes, minlength=size), numpy.ones(size, bool)
+        codes, values = codes[present], values[present]
+        counts = numpy.bincount(codes, minlength=size)
+        if self.func in ('sum', 'avg'):
+            totals = numpy.zeros(size, 'float64' if self.type is float else 'int64')
+            numpy.add.at(totals, codes, values)
+            return (totals if self.func == 'sum' else totals / numpy.maximum(counts, 1)), counts > 0
+        order = numpy.lexsort((values, codes))
+        codes, values = codes[order], values[order]
+        groups = numpy.arange(size)
+        if self.func == 'min':
+            rows = numpy.searchsorted(codes, groups, side='left')
+        else:
+            rows = numpy.searchsorted(codes, groups, side='right') - 1
+        return values[numpy.clip(rows, 0, max(len(values) - 1, 0))] if len(values) else counts, counts > 0
+
+    def run(self, base: dict, columns: 'Columns'):
+        if numpy is None:
+            return self.reduce(base.values())
+        alive = columns.alive(base)
+        values = present = None
+        if self.key is not None:
+            values, present = columns.column(self.key, base)
+            values, present = values[alive], present[alive]
+        if self.by_key is None:
+            return self.reduce_array(values[present])
+        keys, keys_present = columns.column(self.by_key, base)
+        keys, keys_present = keys[alive], keys_present[alive]
+        labels, inverse = numpy.unique(keys[keys_present], return_inverse=True)
+        codes = numpy.zeros(len(keys), 'int64')
+        codes[keys_present] = inverse.reshape(-1) + 1
+        labels = [None] + labels.tolist()
+        rows = numpy.bincount(codes, minlength=len(labels))
+        results, found = self.group_array(codes, len(labels), values, present)
+        empty = 0 if self.func == 'sum' else None
+        return {
+            labels[i]: self.cast(results[i]) if found[i] else empty
+            for i in range(len(labels)) if rows[i]
+        }
+
+
+class Columns:
+    def __init__(self, model: type[BaseModel]):
+        self._model = model
+        self.clear()
+
+    def clear(self):
+        self._ids = None
+        self._rows = None
+        self._alive = None
+        self._columns = {}
+        self._touched = set()
+
+    def invalidate(self, uid):
+        if self._ids is not None:
+            self._touched.add(uid)
+
+    def _build(self, key: str, models: list) -> tuple:
+        field = self._model.__fields__[key]
+        dtype = DTYPES.get(field.type_, 'object')
+        raw = [None if i is None else getattr(i, key) for i in models]
+        present = numpy.fromiter((i is not None for i in raw), bool, len(raw))
+        if dtype != 'object':
+            raw = [0 if i is None else i for i in raw]
+        values = numpy.empty(len(raw), dtype)
+        values[:] = raw
+        return values, present
+
+    def _sync(self, base: dict):
+        if self._ids is None or len(self._rows) * 2 < len(self._ids):
+            self.clear()
+            self._ids = list(base)
+            self._rows = {uid: row for row, uid in enumerate(self._ids)}
+            self._alive = numpy.ones(len(self._ids), bool)
+            return
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, set()
+        added = []
+        for uid in touched:
+            row = self._rows.get(uid)
+            model = base.get(uid)
+            if row is None:
+                if model is not None:
+                    added.append(uid)
+            elif model is None:
+                self._alive[row] = False
+                del self._rows[uid]
+            else:
+                for key, (values, present) in self._columns.items():
+                    value = getattr(model, key)
+                    present[row] = value is not None
+                    values[row] = 0 if value is None and values.dtype != object else value
+        if added:
+            self._rows.update((uid, len(self._ids) + row) for row, uid in enumerate(added))
+            self._ids += added
+            self._alive = numpy.concatenate([self._alive, numpy.ones(len(added), bool)])
+            models = [base[i] for i in added]
+            for key, (values, present) in self._columns.items():
+                new_values, new_present = self._build(key, models)
+                self._columns[key] = numpy.concatenate([values, new_values]), numpy.concatenate([present, new_present])
+
+    def alive(self, base: dict):
+        self._sync(base)
+        return self._alive
+
+    def column(self, key: str, base: dict) -> tuple:
+        self._sync(base)
+        if key not in self._columns:
+            self._columns[key] = self._build(key, [base.get(i) for i in self._ids])
+        return self._columns[key]
+
+
+def parse_aggregate(model: type[BaseModel], name: str) -> Aggregate:
+    if name.startswith('group_count_by_'):
+        return Aggregate(model, 'count', by_key=name[len('group_count_by_'):])
+    func, rest = name.split('_', 1)
+    for by in re.finditer('_by_', rest):
+        key, by_key = rest[:by.start()], rest[by.end():]
+        if key in model.__fields__ and by_key in model.__fields__:
+            return Aggregate(model, func, key, by_key)
+    return Aggregate(model, func, rest)
@@ -25,6 +25,18 @@ class AsyncRepository(ABC):
     async def find_by(self, key: str, value, sort_key: [Callable] = None, desc: [bool] = None) -> list[BaseModel]:
         """find in base by"""
 
+    @abstractmethod
+    async def count_all(self) -> int:
+        """count models in base"""
+
     @abstractmethod
     async def remove(self, model: BaseModel):
         """remove model from base"""
+
+    @abstractmethod
+    async def remove_all(self, models: [BaseModel]) -> [BaseModel]:
+        """remove models from base"""
+
+    @abstractmethod
+    async def remove_by(self, key: str, value) -> list[BaseModel]:
+        """remove from base by"""
@@ -1,81 +1,143 @@
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import Executor
+
 from pydantic import BaseModel
-import json
+from .aggregate import Aggregate
 from .async_core import AsyncRepository
 from abc2db.core import build_repository_impl
+from .json import json_class
+from .lock import TransactionGate
+from .query import Query, Window
 
 
 class AsyncJson(AsyncRepository):
     _model = BaseModel
 
-    _self_add = ['_load', '_save']
-
-    def __init__(self, path):
-        self._path = path
-        self._base = None
-        self._id = 1
-
-    def _load(self):
-        with open(self._path, 'r') as file:
-            base = json.loads(file.read())
-        self._base = {
-            int(k): self._model.parse_obj(v)
-            for k, v in base.items()
-        }
-        if len(self._base.keys()) > 0:
-            self._id = max(self._base.keys()) + 1
-
-    def _save(self):
-        with open(self._path, 'w') as file:
-            file.write(json.dumps(
-                {
-                    str(k): v.dict()
-                    for k, v in self._base.items()
-                }
-            ))
+    _self_add = ['_run', '_execute', '_commit', '_flush', 'transaction']
+
+    def __init__(self, path, executor: [Executor] = None, group_commit: bool = False,
+                 commit_window: float = 0.002, commit_batch: int = 256, **kwargs):
+        kwargs.setdefault('durable', group_commit)
+        self._json = json_class(self._model)(path, **kwargs)
+        self._executor = executor
+        self._lock = asyncio.Lock()
+        self._gate = TransactionGate()
+        self._group_commit = group_commit
+        self._commit_window = commit_window
+        self._commit_batch = commit_batch
+        self._pending = []
+        self._batch_full = asyncio.Event()
+        self._flush_task = None
+
+    async def _run(self, func, *args):
+        await self._gate.wait()
+        return await self._execute(func, *args)
+
+    async def _execute(self, func, *args):
+        async with self._lock:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+            try:
+                return await asyncio.shield(future)
+            finally:
+                if not future.done():
+                    await asyncio.wait([future])
+
+    async def _commit(self, op: str, models: list) -> list:
+        await self._gate.wait()
+        if not self._group_commit:
+            result, = await self._run(self._json._apply, [(op, models)])
+            if isinstance(result, Exception):
+                raise result
+            return result
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((op, models, future))
+        if len(self._pending) >= self._commit_batch:
+            self._batch_full.set()
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        try:
+            await asyncio.wait_for(self._batch_full.wait(), self._commit_window)
+        except asyncio.TimeoutError:
+            pass
+        self._batch_full.clear()
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+        try:
+            results = await self._execute(self._json._apply, [(op, models) for op, models, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @asynccontextmanager
+    async def transaction(self):
+        if self._gate.active():
+            yield self
+            return
+        async with self._gate.hold():
+            if self._flush_task is not None:
+                await self._flush_task
+            await self._run(self._json._begin)
+            try:
+                yield self
+            except BaseException:
+                await self._run(self._json._rollback)
+                raise
+            await self._run(self._json._end)
 
     async def find(self, _id):
-        self._load()
-        return self._base.get(_id)
+        return await self._run(self._json.find, _id)
 
     async def save(self, model):
-        self._load()
-        if model.id is None:
-            model.id = self._id
-            self._id += 1
-        self._base[model.id] = model
-        if model.id >= self._id:
-            self._id = model.id + 1
-        self._save()
-        return model
+        return (await self._commit('save', [model]))[0]
 
     async def save_all(self, models):
-        return [
-            await self.save(i) for i in models
-        ]
+        return await self._commit('save', list(models))
+
+    async def _find_all(self, query: Query, window: [Window] = None) -> list[BaseModel]:
+        return await self._run(self._json._find_all, query, window)
 
     async def find_all(self, sort_key: [str] = None, desc: bool = False) -> list[BaseModel]:
-        self._load()
-        models = list(self._base.values())
-        if sort_key:
-            models.sort(key=lambda i: i.dict(include={sort_key})[sort_key], reverse=desc)
-        return models
+        return await self._run(self._json.find_all, sort_key, desc)
+
+    async def _find_by(self, query: Query, values: tuple, window: [Window] = None) -> list[BaseModel]:
+        return await self._run(self._json._find_by, query, values, window)
 
     async def find_by(self, key: str, value, sort_key: [str] = None, desc: [bool] = None) -> list[BaseModel]:
-        self._load()
-        _models = list(self._base.values())
-        models = []
-        for i in _models:
-            if i.dict(include={key})[key] == value:
-                models.append(i)
-        if sort_key:
-            models.sort(key=lambda j: j.dict(include={sort_key})[sort_key], reverse=desc)
-        return models
+        return await self._run(self._json.find_by, key, value, sort_key, desc)
+
+    async def count_all(self) -> int:
+        return await self._run(self._json.count_all)
+
+    async def _count_by(self, query: Query, values: tuple) -> int:
+        return await self._run(self._json._count_by, query, values)
+
+    async def _exists_by(self, query: Query, values: tuple) -> bool:
+        return await self._run(self._json._exists_by, query, values)
+
+    async def _aggregate(self, aggregate: Aggregate):
+        return await self._run(self._json._aggregate, aggregate)
 
     async def remove(self, model):
-        self._load()
-        self._base.pop(model.id)
-        self._save()
-        return model
+        return (await self._commit('remove', [model]))[0]
+
+    async def remove_all(self, models):
+        return await self._commit('remove', list(models))
+
+    async def _remove_by(self, query: Query, values: tuple) -> list[BaseModel]:
+        return await self._run(self._json._remove_by, query, values)
+
+    async def remove_by(self, key: str, value) -> list[BaseModel]:
+        return await self._run(self._json.remove_by, key, value)
 
 
 def abc2db_async_json(abc_class: type) -> type:
@@ -0,0 +1,100 @@
+import asyncio
+from concurrent.futures import Executor
+
+from pydantic import BaseModel
+from .aggregate import Aggregate
+from .async_core import AsyncRepository
+from abc2db.core import build_repository_impl
+from .query import Query, Window
+from .sqlite import Sqlite, check_ranges, sqlite_class
+
+
+class AsyncSqlite(AsyncRepository):
+    _model = BaseModel
+    _index_keys = ()
+    _sort_keys = ()
+
+    _self_add = ['_run', '_read', '_write', 'close']
+
+    def __init__(self, path, readers: int = 4, executor: [Executor] = None):
+        sqlite = sqlite_class(self._model, self._index_keys, self._sort_keys)
+        self._writer = sqlite(path, check_same_thread=False)
+        self._readers = asyncio.Queue()
+        for _ in range(readers):
+            self._readers.put_nowait(sqlite(path, check_same_thread=False))
+        self._executor = executor
+        self._lock = asyncio.Lock()
+
+    async def _run(self, func, *args):
+        future = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if not future.done():
+                await asyncio.wait([future])
+
+    async def _read(self, func, *args):
+        reader = await self._readers.get()
+        try:
+            return await self._run(func, reader, *args)
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def _write(self, func, *args):
+        async with self._lock:
+            return await self._run(func, self._writer, *args)
+
+    async def close(self):
+        async with self._lock:
+            self._writer.close()
+            while not self._readers.empty():
+                self._readers.get_nowait().close()
+
+    async def find(self, _id):
+        return await self._read(Sqlite.find, _id)
+
+    async def save(self, model):
+        return await self._write(Sqlite.save, model)
+
+    async def save_all(self, models):
+        return await self._write(Sqlite.save_all, list(models))
+
+    async def _find_all(self, query: Query, window: [Window] = None) -> list[BaseModel]:
+        return await self._read(lambda reader: list(reader._find_all(query, window)))
+
+    async def find_all(self, sort_key: [str] = None, desc: bool = False) -> list[BaseModel]:
+        return await self._read(Sqlite.find_all, sort_key, desc)
+
+    async def _find_by(self, query: Query, values: tuple, window: [Window] = None) -> list[BaseModel]:
+        return await self._read(lambda reader: list(reader._find_by(query, values, window)))
+
+    async def find_by(self, key: str, value, sort_key: [str] = None, desc: [bool] = None) -> list[BaseModel]:
+        return await self._read(Sqlite.find_by, key, value, sort_key, desc)
+
+    async def count_all(self) -> int:
+        return await self._read(Sqlite.count_all)
+
+    async def _count_by(self, query: Query, values: tuple) -> int:
+        return await self._read(Sqlite._count_by, query, values)
+
+    async def _exists_by(self, query: Query, values: tuple) -> bool:
+        return await self._read(Sqlite._exists_by, query, values)
+
+    async def _aggregate(self, aggregate: Aggregate):
+        return await self._read(Sqlite._aggregate, aggregate)
+
+    async def remove(self, model):
+        return await self._write(Sqlite.remove, model)
+
+    async def remove_all(self, models):
+        return await self._write(Sqlite.remove_all, list(models))
+
+    async def _remove_by(self, query: Query, values: tuple) -> list[BaseModel]:
+        return await self._write(Sqlite._remove_by, query, values)
+
+    async def remove_by(self, key: str, value) -> list[BaseModel]:
+        return await self._write(Sqlite.remove_by, key, value)
+
+
+def abc2db_async_sqlite(abc_class: type) -> type:
+    return check_ranges(abc_class, build_repository_impl(abc_class, AsyncSqlite))
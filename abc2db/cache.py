@@ -0,0 +1,220 @@
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from inspect import iscoroutinefunction
+from time import monotonic
+
+from .core import bind_args
+from .query import parse_query
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, max_items: int = 1024, ttl: [float] = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] is not None and item[0] <= monotonic():
+                del self._items[key]
+                self.evictions += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return MISSING
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value, generation: [int] = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._items[key] = (None if self.ttl is None else monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, stale):
+        with self._lock:
+            self.generation += 1
+            for key in [k for k, (_, v) in self._items.items() if stale(k, v)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._items.clear()
+
+
+def query_key(name: str, args: tuple) -> [tuple]:
+    key = (name, args)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def invalidate(cache: LRUCache, models: list):
+    ids = {i.id for i in models}
+
+    def stale(key, value):
+        if key[0] == 'find':
+            return key[1] in ids
+        query, split, _, result_ids, offset = value
+        return offset or not result_ids.isdisjoint(ids) or any(query.match(i, split) for i in models)
+
+    cache.invalidate(stale)
+
+
+def query_entry(query, args: tuple, models: list) -> tuple:
+    values, window = query.bind(args)
+    return query, query.split(values), models, {i.id for i in models}, window is not None and window.offset > 0
+
+
+def cached_find(meth):
+    def _wrap(self, _id):
+        model = self.cache.get(('find', _id))
+        if model is MISSING:
+            generation = self.cache.generation
+            model = meth(self, _id)
+            self.cache.put(('find', _id), model, generation)
+        return model
+
+    return _wrap
+
+
+def cached_async_find(meth):
+    async def _wrap(self, _id):
+        model = self.cache.get(('find', _id))
+        if model is MISSING:
+            generation = self.cache.generation
+            model = await meth(self, _id)
+            self.cache.put(('find', _id), model, generation)
+        return model
+
+    return _wrap
+
+
+def cached_query(meth, name: str, query, bind):
+    def _wrap(self, *args, **kwargs):
+        args = bind(args, kwargs)
+        key = query_key(name, args)
+        if key is None:
+            return meth(self, *args)
+        entry = self.cache.get(key)
+        if entry is MISSING:
+            generation = self.cache.generation
+            entry = query_entry(query, args, meth(self, *args))
+            self.cache.put(key, entry, generation)
+        return list(entry[2])
+
+    return _wrap
+
+
+def cached_async_query(meth, name: str, query, bind):
+    async def _wrap(self, *args, **kwargs):
+        args = bind(args, kwargs)
+        key = query_key(name, args)
+        if key is None:
+            return await meth(self, *args)
+        entry = self.cache.get(key)
+        if entry is MISSING:
+            generation = self.cache.generation
+            entry = query_entry(query, args, await meth(self, *args))
+            self.cache.put(key, entry, generation)
+        return list(entry[2])
+
+    return _wrap
+
+
+def cached_write(meth, many: bool):
+    def _wrap(self, *args):
+        result = meth(self, *args)
+        invalidate(self.cache, list(result) if many else [result])
+        return result
+
+    return _wrap
+
+
+def cached_async_write(meth, many: bool):
+    async def _wrap(self, *args):
+        result = await meth(self, *args)
+        invalidate(self.cache, list(result) if many else [result])
+        return result
+
+    return _wrap
+
+
+def cached_transaction(meth):
+    @contextmanager
+    def _wrap(self):
+        try:
+            with meth(self):
+                yield self
+        except BaseException:
+            self.cache.clear()
+            raise
+
+    return _wrap
+
+
+def cached_async_transaction(meth):
+    @asynccontextmanager
+    async def _wrap(self):
+        try:
+            async with meth(self):
+                yield self
+        except BaseException:
+            self.cache.clear()
+            raise
+
+    return _wrap
+
+
+def abc2db_cached(abc_class: type, backend_factory, max_items: int = 1024, ttl: [float] = None) -> type:
+    backend = backend_factory(abc_class)
+    backend_dict = backend.__dict__
+    is_async = iscoroutinefunction(backend_dict['find'])
+    init = backend_dict['__init__']
+
+    def __init__(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        self.cache = LRUCache(max_items, ttl)
+
+    attrs = {'__init__': __init__}
+    for k in abc_class.__dict__:
+        if k not in backend_dict:
+            continue
+        meth = backend_dict[k]
+        if k == 'find':
+            attrs[k] = (cached_async_find if is_async else cached_find)(meth)
+        elif k in ('save', 'remove'):
+            attrs[k] = (cached_async_write if is_async else cached_write)(meth, False)
+        elif k in ('save_all', 'remove_all') or k.startswith('remove_by'):
+            attrs[k] = (cached_async_write if is_async else cached_write)(meth, True)
+        elif k.startswith('find_by') or k.startswith('find_all'):
+            query = parse_query(backend._model, k)
+            if not query.lazy:
+                wrap = cached_async_query if is_async else cached_query
+                attrs[k] = wrap(meth, k, query, bind_args(abc_class.__dict__[k]))
+    if 'transaction' in backend_dict:
+        attrs['transaction'] = (cached_async_transaction if is_async else cached_transaction)(
+            backend_dict['transaction']
+        )
+
+    return type(backend.__name__ + 'Cached', (backend,), attrs)
@@ -0,0 +1,113 @@
+import json
+import pickle
+from abc import ABC, abstractmethod
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(ABC):
+    name = ''
+    magic = b''
+    text = False
+
+    @abstractmethod
+    def dumps(self, data) -> bytes:
+        """encode data to bytes"""
+
+    @abstractmethod
+    def loads(self, data: bytes):
+        """decode data from bytes"""
+
+
+class JsonCodec(Codec):
+    name = 'json'
+    text = True
+
+    def dumps(self, data) -> bytes:
+        return json.dumps(data).encode()
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = 'orjson'
+    text = True
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('orjson codec requires the orjson package')
+
+    def dumps(self, data) -> bytes:
+        return orjson.dumps(data)
+
+    def loads(self, data: bytes):
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+    magic = b'ABC2DB:msgpack\n'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('msgpack codec requires the msgpack package')
+
+    def dumps(self, data) -> bytes:
+        return msgpack.packb(data)
+
+    def loads(self, data: bytes):
+        return msgpack.unpackb(data, strict_map_key=False)
+
+
+class PickleCodec(Codec):
+    name = 'pickle'
+    magic = b'ABC2DB:pickle\n'
+
+    def dumps(self, data) -> bytes:
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: bytes):
+        return pickle.loads(data)
+
+
+CODECS = {
+    i.name: i for i in (JsonCodec, OrjsonCodec, MsgpackCodec, PickleCodec)
+}
+
+
+def get_codec(codec: [str, Codec] = 'json') -> Codec:
+    if isinstance(codec, Codec):
+        return codec
+    if codec not in CODECS:
+        raise ValueError(f'unknown codec {codec!r}, expected one of {", ".join(CODECS)}')
+    return CODECS[codec]()
+
+
+def encode(codec: Codec, data) -> bytes:
+    return codec.magic + codec.dumps(data)
+
+
+def decode(codec: Codec, data: bytes):
+    for name in ('msgpack', 'pickle'):
+        magic = CODECS[name].magic
+        if not data.startswith(magic):
+            continue
+        if codec.name != name:
+            if name == 'pickle':
+                raise ValueError('refusing to load a pickle file without codec="pickle"')
+            codec = get_codec(name)
+        return codec.loads(data[len(magic):])
+    return journal_codec(codec).loads(data)
+
+
+def journal_codec(codec: Codec) -> Codec:
+    return codec if codec.text else JsonCodec()
@@ -0,0 +1,90 @@
+import sys
+from array import array
+from collections.abc import MutableMapping
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON, ModelField
+
+TYPECODES = {
+    bool: 'b',
+    int: 'q',
+    float: 'd',
+}
+
+
+class Column:
+    def __init__(self, field: ModelField):
+        singleton = field.shape == SHAPE_SINGLETON
+        self.type = field.type_
+        self.typecode = TYPECODES.get(field.type_) if singleton else None
+        self.intern = singleton and field.type_ is str
+        self.values = array(self.typecode) if self.typecode else []
+        self.nulls = bytearray()
+
+    def _unpack(self):
+        self.values = [None if null else value for value, null in zip(self.values, self.nulls)]
+        self.typecode = None
+
+    def set(self, slot: int, value):
+        if slot == len(self.nulls):
+            self.nulls.append(0)
+            self.values.append(0 if self.typecode else None)
+        self.nulls[slot] = value is None
+        if value is None:
+            value = 0 if self.typecode else None
+        elif self.intern and type(value) is str:
+            value = sys.intern(value)
+        try:
+            self.values[slot] = value
+        except (OverflowError, TypeError):
+            self._unpack()
+            self.values[slot] = value
+
+    def clear(self, slot: int):
+        self.set(slot, None)
+
+    def get(self, slot: int):
+        if self.nulls[slot]:
+            return None
+        value = self.values[slot]
+        return self.type(value) if self.typecode == 'b' else value
+
+
+class CompactBase(MutableMapping):
+    def __init__(self, model: type[BaseModel]):
+        self._model = model
+        self._slots = {}
+        self._free = []
+        self._size = 0
+        self._columns = {k: Column(v) for k, v in model.__fields__.items() if k != 'id'}
+
+    def __getitem__(self, uid) -> BaseModel:
+        slot = self._slots[uid]
+        return self._model.construct(id=uid, **{k: v.get(slot) for k, v in self._columns.items()})
+
+    def __setitem__(self, uid, model: BaseModel):
+        slot = self._slots.get(uid)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = self._size
+                self._size += 1
+            self._slots[uid] = slot
+        for k, v in self._columns.items():
+            v.set(slot, getattr(model, k))
+
+    def __delitem__(self, uid):
+        slot = self._slots.pop(uid)
+        for v in self._columns.values():
+            v.clear(slot)
+        self._free.append(slot)
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, uid) -> bool:
+        return uid in self._slots
@@ -1,7 +1,13 @@
+import asyncio
 from abc import ABC, abstractmethod
+from inspect import Parameter, iscoroutinefunction, signature
 from typing import get_type_hints
 
 from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+
+from .aggregate import PREFIXES, parse_aggregate
+from .query import RANGES, Window, parse_query
 
 
 class Repository(ABC):
@@ -25,44 +31,107 @@ class Repository(ABC):
     def find_by(self, key: str, value, sort_key: [str] = None, desc: [bool] = None) -> list[BaseModel]:
         """find in base by"""
 
+    @abstractmethod
+    def count_all(self) -> int:
+        """count models in base"""
+
     @abstractmethod
     def remove(self, model: BaseModel):
         """remove model from base"""
 
+    @abstractmethod
+    def remove_all(self, models: [BaseModel]) -> [BaseModel]:
+        """remove models from base"""
+
+    @abstractmethod
+    def remove_by(self, key: str, value) -> list[BaseModel]:
+        """remove from base by"""
 
-def _find_sort_values(string: str) -> dict:
-    vals = {
-        'sort_key': None,
-        'desc': False
-    }
-    if '_desc' in string:
-        vals['desc'] = True
-        string = string.replace('_desc', '')
-    if 'sort_by' in string:
-        vals['sort_key'] = string.split('sort_by_')[1]
-    return vals
 
+def find_args(query, values: tuple, window: [Window]) -> tuple:
+    return (values, window) if query.predicates else (window,)
 
-def wrap_get_all(repo_meth, sort_key, desc):
-    def _wrap(self):
-        return repo_meth(self, sort_key, desc)
+
+def bind_args(abc_meth):
+    abc_signature = signature(abc_meth)
+    params = list(abc_signature.parameters.values())[1:]
+    positional = all(i.kind in (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD) for i in params)
+
+    def bind(args: tuple, kwargs: dict) -> tuple:
+        if positional and not kwargs and len(args) == len(params):
+            return args
+        bound = abc_signature.bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        return bound.args[1:]
+
+    return bind
+
+
+def wrap_find(repo_meth, query, bind):
+    def _wrap(self, *args, **kwargs):
+        values, window = query.bind(bind(args, kwargs))
+        models = repo_meth(self, query, *find_args(query, values, window))
+        return iter(models) if query.lazy else list(models)
 
     return _wrap
 
 
-def wrap_find_by(repo_meth, by_key, sort_key, desc):
-    def _wrap(self, v):
-        return repo_meth(self, by_key, v, sort_key, desc)
+def wrap_async_find(repo_meth, query, bind):
+    async def _wrap(self, *args, **kwargs):
+        values, window = query.bind(bind(args, kwargs))
+        return list(await repo_meth(self, query, *find_args(query, values, window)))
+
+    async def _wrap_iter(self, *args, **kwargs):
+        values, window = query.bind(bind(args, kwargs))
+        models = list(await repo_meth(self, query, *find_args(query, values, window)))
+        for start in range(0, len(models), query.batch):
+            for i in models[start:start + query.batch]:
+                yield i
+            await asyncio.sleep(0)
+
+    return _wrap_iter if query.lazy else _wrap
+
+
+def wrap_by(repo_meth, query, bind):
+    def _wrap(self, *args, **kwargs):
+        return repo_meth(self, query, bind(args, kwargs))
+
+    return _wrap
+
+
+def wrap_aggregate(repo_meth, aggregate):
+    def _wrap(self):
+        return repo_meth(self, aggregate)
 
     return _wrap
 
 
+def hashable(model: type[BaseModel], key: str) -> bool:
+    field = model.__fields__[key]
+    return field.shape == SHAPE_SINGLETON and isinstance(field.type_, type) and field.type_.__hash__ is not None
+
+
+def _declare_indexes(query, index_keys: list, sort_keys: list, model: type[BaseModel]):
+    for key, op in query.predicates:
+        if op not in RANGES and not hashable(model, key):
+            continue
+        keys = sort_keys if op in RANGES else index_keys
+        if key not in keys:
+            keys.append(key)
+    if query.sort_key and query.sort_key not in sort_keys:
+        sort_keys.append(query.sort_key)
+
+
 def build_repository_impl(abc_class, repository_impl) -> type:
     impl_dict = repository_impl.__dict__
+    model = get_type_hints(abc_class.__dict__['find'])['return']
+    wrap = wrap_async_find if iscoroutinefunction(impl_dict['find']) else wrap_find
     attrs = {
         '__init__': impl_dict['__init__'],
-        '_model': get_type_hints(abc_class.__dict__['find'])['return']
+        '_model': model
     }
+    index_keys = []
+    sort_keys = []
 
     for k, v in abc_class.__dict__.items():
         if k == 'find':
@@ -73,17 +142,35 @@ def build_repository_impl(abc_class, repository_impl) -> type:
             attrs.update({'remove': impl_dict['remove']})
         elif k == 'save_all':
             attrs.update({'save_all': impl_dict['save_all']})
-        elif k.startswith('find_by'):
-            by_key = k.replace('find_by_', '').split('_sort_by')[0]
-            sort_vals = _find_sort_values(k)
+        elif k == 'remove_all':
+            attrs.update({'remove_all': impl_dict['remove_all']})
+        elif k == 'count_all':
+            attrs.update({'count_all': impl_dict['count_all']})
+        elif k.startswith('count_by') or k.startswith('exists_by'):
+            query = parse_query(model, k)
+            _declare_indexes(query, index_keys, sort_keys, model)
+            attrs.update({
+                k: wrap_by(impl_dict['_count_by' if k.startswith('count_by') else '_exists_by'], query, bind_args(v))
+            })
+        elif k.startswith(PREFIXES):
             attrs.update({
-                k: wrap_find_by(impl_dict['find_by'], by_key, sort_vals['sort_key'], sort_vals['desc'])
+                k: wrap_aggregate(impl_dict['_aggregate'], parse_aggregate(model, k))
             })
-        elif k.startswith('find_all'):
-            sort_vals = _find_sort_values(k)
+        elif k.startswith('remove_by'):
+            query = parse_query(model, k)
+            _declare_indexes(query, index_keys, sort_keys, model)
             attrs.update({
-                k: wrap_get_all(impl_dict['find_all'], sort_vals['sort_key'], sort_vals['desc'])
+                k: wrap_by(impl_dict['_remove_by'], query, bind_args(v))
             })
+        elif k.startswith('find_by') or k.startswith('find_all'):
+            query = parse_query(model, k)
+            _declare_indexes(query, index_keys, sort_keys, model)
+            attrs.update({
+                k: wrap(impl_dict['_find_by' if query.predicates else '_find_all'], query, bind_args(v))
+            })
+
+    attrs['_index_keys'] = tuple(index_keys)
+    attrs['_sort_keys'] = tuple(sort_keys)
 
     if '_self_add' in impl_dict:
         for j in impl_dict['_self_add']:
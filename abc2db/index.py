@@ -0,0 +1,111 @@
+from bisect import bisect_left, bisect_right, insort
+from math import inf
+
+
+def sort_value(value):
+    return value is not None, value
+
+
+class HashIndex:
+    def __init__(self, key: str):
+        self.key = key
+        self._values = {}
+        self._buckets = {}
+
+    def add(self, model):
+        uid = model.id
+        value = getattr(model, self.key)
+        if uid in self._values:
+            if self._values[uid] == value:
+                return
+            self.remove(uid)
+        self._values[uid] = value
+        self._buckets.setdefault(value, {})[uid] = None
+
+    def load(self, ids, values):
+        self._values = dict(zip(ids, values))
+        self._buckets = {}
+        for uid, value in self._values.items():
+            self._buckets.setdefault(value, {})[uid] = None
+
+    def remove(self, uid):
+        if uid not in self._values:
+            return
+        value = self._values.pop(uid)
+        bucket = self._buckets[value]
+        del bucket[uid]
+        if not bucket:
+            del self._buckets[value]
+
+    def find(self, value) -> list:
+        return sorted(self._buckets.get(value, ()))
+
+    def count(self, value) -> int:
+        return len(self._buckets.get(value, ()))
+
+
+class SortedIndex:
+    def __init__(self, key: str):
+        self.key = key
+        self._values = {}
+        self._entries = []
+
+    def add(self, model):
+        uid = model.id
+        value = sort_value(getattr(model, self.key))
+        if uid in self._values:
+            if self._values[uid] == value:
+                return
+            self.remove(uid)
+        self._values[uid] = value
+        insort(self._entries, (value, uid))
+
+    def load(self, ids, values):
+        self._values = {uid: sort_value(value) for uid, value in zip(ids, values)}
+        self._entries = sorted(zip(self._values.values(), self._values.keys()))
+
+    def remove(self, uid):
+        if uid not in self._values:
+            return
+        entry = (self._values.pop(uid), uid)
+        del self._entries[bisect_left(self._entries, entry)]
+
+    def iter(self, desc: bool = False, after: [tuple] = None):
+        entries = self._entries
+        if not desc:
+            start = 0 if after is None else bisect_right(entries, after)
+            for i in range(start, len(entries)):
+                yield entries[i][1]
+            return
+        end = len(entries)
+        if after is not None:
+            for i in range(bisect_right(entries, after), bisect_left(entries, (after[0], inf))):
+                yield entries[i][1]
+            end = bisect_left(entries, (after[0],))
+        while end > 0:
+            start = bisect_left(entries, (entries[end - 1][0],), 0, end)
+            for i in range(start, end):
+                yield entries[i][1]
+            end = start
+
+    def span(self, op: str, args: tuple) -> tuple[int, int]:
+        entries = self._entries
+        if op == 'gt':
+            return bisect_left(entries, (sort_value(args[0]), inf)), len(entries)
+        if op == 'gte':
+            return bisect_left(entries, (sort_value(args[0]),)), len(entries)
+        start = bisect_left(entries, ((True,),))
+        if op == 'lt':
+            return start, bisect_left(entries, (sort_value(args[0]),))
+        if op == 'lte':
+            return start, bisect_left(entries, (sort_value(args[0]), inf))
+        return bisect_left(entries, (sort_value(args[0]),)), bisect_left(entries, (sort_value(args[1]), inf))
+
+    def range(self, op: str, args: tuple) -> list:
+        start, end = self.span(op, args)
+        return [uid for _, uid in self._entries[start:end]]
+
+    def sort(self, ids, desc: bool = False) -> list:
+        ids = sorted(ids)
+        ids.sort(key=self._values.__getitem__, reverse=desc)
+        return ids
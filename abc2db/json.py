@@ -1,82 +1,494 @@
+import hashlib
 import json
+import os
+import threading
+import zlib
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from functools import lru_cache
 
 from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON, ModelField
+from pydantic.json import pydantic_encoder
 
+from .aggregate import Aggregate, Columns
+from .codecs import Codec, JsonCodec, decode, encode, get_codec, journal_codec
 from .core import build_repository_impl, Repository
+from .query import Query, Window, compile_query
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FORMAT_VERSION = 1
+NATIVE_TYPES = (bool, int, float, str)
+
+
+def schema_fingerprint(model: type[BaseModel]) -> str:
+    return hashlib.sha256(json.dumps(model.schema(), sort_keys=True).encode()).hexdigest()[:16]
+
+
+def native_field(field: ModelField) -> bool:
+    return field.shape == SHAPE_SINGLETON and field.type_ in NATIVE_TYPES
+
+
+def json_native(model: type[BaseModel]) -> bool:
+    return all(native_field(i) for i in model.__fields__.values())
+
+
+def plain(value):
+    return json.loads(json.dumps(value, default=pydantic_encoder))
+
+
+def read_meta(path) -> [dict]:
+    try:
+        with open(path, 'r') as file:
+            meta = json.loads(file.read())
+    except (FileNotFoundError, ValueError):
+        return None
+    return meta if meta.get('version') == FORMAT_VERSION else None
+
+
+def file_stamp(path) -> [tuple]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def read_journal(path, end: [int] = None, codec: Codec = JsonCodec()) -> tuple[list[dict], int]:
+    try:
+        with open(path, 'rb') as file:
+            data = file.read() if end is None else file.read(end)
+    except FileNotFoundError:
+        return [], 0
+    records = []
+    size = 0
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b'\n'):
+            break
+        records.append(codec.loads(line))
+        size += len(line)
+    return records, size
+
+
+def replay_journal(base: dict, records: list[dict]):
+    for record in records:
+        if record['op'] == 'upsert':
+            base[str(record['id'])] = record['data']
+        else:
+            base.pop(str(record['id']), None)
+
+
+def write_atomic(path, data: bytes):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+class LazyBase(MutableMapping):
+    def __init__(self, parse, raw: dict):
+        self._parse = parse
+        self._items = raw
+
+    def __getitem__(self, uid) -> BaseModel:
+        value = self._items[uid]
+        if type(value) is dict:
+            value = self._items[uid] = self._parse(value)
+        return value
+
+    def __setitem__(self, uid, model: BaseModel):
+        self._items[uid] = model
+
+    def __delitem__(self, uid):
+        del self._items[uid]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, uid) -> bool:
+        return uid in self._items
+
+    def rows(self):
+        return self._items.values()
+
+    def raw(self, uid) -> dict:
+        value = self._items[uid]
+        return value if type(value) is dict else value.dict()
 
 
 class Json(Repository):
+    """json file base; like Memory, found models are the cached instances, so unsaved changes to them
+    are written by the next save. strict=True re-reads the file and returns fresh models on every call"""
     _model = BaseModel
 
-    _self_add = ['_load', '_save']
+    _self_add = ['_load', '_save', '_write_meta', '_put', '_check_removed', '_apply', '_matches', '_stamps',
+                 '_maybe_compact', 'compact', '_begin', '_rollback', '_end', 'transaction', '_acquire', '_release',
+                 '_file_lock']
 
-    def __init__(self, path):
+    def __init__(self, path, strict: bool = False, journal: bool = False,
+                 compact_size: int = 1 << 20, compact_ratio: [float] = 1.0, trusted: bool = False,
+                 codec: [str, Codec] = 'json', multiprocess: bool = False, durable: bool = False):
+        if multiprocess and fcntl is None:
+            raise ImportError('multiprocess mode requires fcntl')
+        if multiprocess and journal:
+            raise ValueError('multiprocess mode does not support journal=True')
         self._path = path
+        self._codec = get_codec(codec)
+        self._journal_codec = journal_codec(self._codec)
+        self._strict = strict
+        self._durable = durable or multiprocess
+        self._construct = lambda i: self._model.construct(**i)
+        self._parse = self._construct if trusted else (lambda i: self._model.parse_obj(i))
+        self._journal = path + '.journal' if journal else None
+        self._meta = path + '.meta'
+        self._fingerprint = schema_fingerprint(self._model)
+        self._native = json_native(self._model)
+        self._compact_size = compact_size
+        self._compact_ratio = compact_ratio
+        self._compaction = None
+        self._compact_lock = threading.Lock()
+        self._lock = threading.Lock()
         self._base = None
+        self._columns = Columns(self._model)
         self._id = 1
+        self._stamp = None
+        self._pending = None
+        self._multiprocess = multiprocess
+        self._lock_path = path + '.lock'
+        self._lock_file = None
+        self._lock_depth = 0
+        self._seq = None
+
+    def _acquire(self, exclusive: bool):
+        if not self._multiprocess:
+            return
+        if not self._lock_depth:
+            file = open(self._lock_path, 'a')
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            except BaseException:
+                file.close()
+                raise
+            self._lock_file = file
+        self._lock_depth += 1
+
+    def _release(self):
+        if not self._multiprocess:
+            return
+        self._lock_depth -= 1
+        if not self._lock_depth:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        self._acquire(exclusive)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _stamps(self) -> tuple:
+        return file_stamp(self._path), self._journal and file_stamp(self._journal)
 
     def _load(self):
-        with open(self._path, 'r') as file:
-            base = json.loads(file.read())
-        self._base = {
-            int(k): self._model.parse_obj(v)
-            for k, v in base.items()
-        }
-        if len(self._base.keys()) > 0:
-            self._id = max(self._base.keys()) + 1
-
-    def _save(self):
-        with open(self._path, 'w') as file:
-            file.write(json.dumps(
-                {
-                    str(k): v.dict()
-                    for k, v in self._base.items()
-                }
-            ))
+        with self._lock, self._file_lock(False):
+            if self._pending is not None and self._base is not None:
+                return
+            stamp = self._stamps()
+            meta = read_meta(self._meta) if self._multiprocess else None
+            current = stamp == self._stamp and (not self._multiprocess or (meta or {}).get('seq') == self._seq)
+            if not self._strict and self._base is not None and current:
+                return
+            if not self._multiprocess:
+                meta = read_meta(self._meta)
+            with open(self._path, 'rb') as file:
+                data = file.read()
+            base = decode(self._codec, data)
+            records = []
+            if self._journal:
+                records, size = read_journal(self._journal, codec=self._journal_codec)
+                replay_journal(base, records)
+                if stamp[1] and size < stamp[1][1]:
+                    os.truncate(self._journal, size)
+                    stamp = self._stamps()
+        valid = meta is not None and meta['crc'] == zlib.crc32(data)
+        parse = self._parse
+        if valid and not records and meta['schema'] == self._fingerprint and self._native:
+            parse = self._construct
+        self._base = LazyBase(parse, {int(k): v for k, v in base.items()})
+        self._columns.clear()
+        ids = [i['id'] + 1 for i in records if i['op'] == 'upsert']
+        self._seq = meta and meta.get('seq')
+        if valid:
+            self._id = max([meta['next_id']] + ids)
+        elif len(self._base.keys()) > 0 or ids:
+            self._id = max(ids + [i + 1 for i in self._base.keys()])
+        self._stamp = stamp
+
+    def _save(self, saved=(), removed=()):
+        if self._pending is not None:
+            pending_saved, pending_removed = self._pending
+            for i in saved:
+                pending_saved[i.id] = i
+                pending_removed.pop(i.id, None)
+            for i in removed:
+                pending_removed[i] = None
+                pending_saved.pop(i, None)
+            return
+        if self._journal is None:
+            data = encode(self._codec, {
+                str(k): self._base.raw(k)
+                for k in self._base
+            })
+            if self._durable:
+                write_atomic(self._path, data)
+            else:
+                with open(self._path, 'wb') as file:
+                    file.write(data)
+            self._stamp = self._stamps()
+            self._seq = (self._seq or 0) + 1
+            self._write_meta(data, self._id, len(self._base))
+            return
+        dumps = self._journal_codec.dumps
+        lines = [dumps({'op': 'upsert', 'id': i.id, 'data': i.dict()}) + b'\n' for i in saved]
+        lines += [dumps({'op': 'delete', 'id': i}) + b'\n' for i in removed]
+        with self._lock:
+            with open(self._journal, 'ab') as file:
+                file.write(b''.join(lines))
+                if self._durable:
+                    file.flush()
+                    os.fsync(file.fileno())
+            self._stamp = self._stamps()
+        self._maybe_compact()
+
+    def _write_meta(self, data: bytes, next_id: int, count: int):
+        with open(self._meta, 'w') as file:
+            file.write(json.dumps({
+                'version': FORMAT_VERSION,
+                'codec': self._codec.name,
+                'schema': self._fingerprint,
+                'next_id': next_id,
+                'count': count,
+                'seq': self._seq,
+                'crc': zlib.crc32(data)
+            }))
+
+    def _maybe_compact(self):
+        snapshot, journal = self._stamp
+        if journal[1] < self._compact_size:
+            return
+        if self._compact_ratio is not None and journal[1] < snapshot[1] * self._compact_ratio:
+            return
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(target=self.compact, daemon=True)
+        self._compaction.start()
+
+    def compact(self):
+        if self._journal is None:
+            return
+        with self._compact_lock:
+            with self._lock:
+                with open(self._path, 'rb') as file:
+                    base = decode(self._codec, file.read())
+                records, size = read_journal(self._journal, codec=self._journal_codec)
+            if size == 0:
+                return
+            replay_journal(base, records)
+            data = encode(self._codec, base)
+            with self._lock:
+                stamp = self._stamps()
+                write_atomic(self._path, data)
+                self._write_meta(data, max([self._id] + [int(i) + 1 for i in base]), len(base))
+                with open(self._journal, 'rb') as file:
+                    file.seek(size)
+                    tail = file.read()
+                write_atomic(self._journal, tail)
+                if self._stamp == stamp:
+                    self._stamp = self._stamps()
+
+    def _begin(self):
+        self._acquire(True)
+        try:
+            self._load()
+        except BaseException:
+            self._release()
+            raise
+        self._pending = ({}, {})
+
+    def _rollback(self):
+        self._pending = None
+        self._base = None
+        self._stamp = None
+        self._release()
+
+    def _end(self):
+        (saved, removed), self._pending = self._pending, None
+        try:
+            if saved or removed:
+                self._save(list(saved.values()), list(removed))
+        finally:
+            self._release()
+
+    @contextmanager
+    def transaction(self):
+        if self._pending is not None:
+            yield self
+            return
+        self._begin()
+        try:
+            yield self
+        except BaseException:
+            self._rollback()
+            raise
+        self._end()
 
     def find(self, _id):
         self._load()
         return self._base.get(_id)
 
-    def save(self, model):
-        self._load()
+    def _put(self, model):
         if model.id is None:
             model.id = self._id
             self._id += 1
         self._base[model.id] = model
+        self._columns.invalidate(model.id)
         if model.id >= self._id:
             self._id = model.id + 1
-        self._save()
-        return model
+
+    def _check_removed(self, models):
+        for i in models:
+            if i.id not in self._base:
+                raise KeyError(i.id)
+
+    def save(self, model):
+        with self._file_lock(True):
+            self._load()
+            self._put(model)
+            self._save([model])
+            return model
 
     def save_all(self, models):
-        return [
-            self.save(i) for i in models
-        ]
+        models = list(models)
+        with self._file_lock(True):
+            self._load()
+            for i in models:
+                self._put(i)
+            self._save(models)
+            return models
+
+    def _apply(self, ops: list[tuple[str, list]]) -> list:
+        with self._file_lock(True):
+            self._load()
+            saved = {}
+            removed = {}
+            results = []
+            for op, models in ops:
+                try:
+                    if op != 'save':
+                        self._check_removed(models)
+                    for i in models:
+                        if op == 'save':
+                            self._put(i)
+                            saved[i.id] = i
+                            removed.pop(i.id, None)
+                        else:
+                            self._base.pop(i.id, None)
+                            self._columns.invalidate(i.id)
+                            removed[i.id] = None
+                            saved.pop(i.id, None)
+                except Exception as e:
+                    results.append(e)
+                else:
+                    results.append(models)
+            if saved or removed:
+                self._save(list(saved.values()), list(removed))
+            return results
+
+    def _find_all(self, query: Query, window: [Window] = None) -> list[BaseModel]:
+        self._load()
+        return query.select(self._base.values(), window)
 
     def find_all(self, sort_key: [str] = None, desc: bool = False) -> list[BaseModel]:
+        return self._find_all(compile_query(self._model, sort_key=sort_key, desc=desc))
+
+    def _find_by(self, query: Query, values: tuple, window: [Window] = None) -> list[BaseModel]:
         self._load()
-        models = list(self._base.values())
-        if sort_key:
-            models.sort(key=lambda i: i.dict(include={sort_key})[sort_key], reverse=desc)
-        return models
+        return query.select(query.filter(self._base.values(), values), window)
 
     def find_by(self, key: str, value, sort_key: [str] = None, desc: [bool] = None) -> list[BaseModel]:
+        return self._find_by(compile_query(self._model, key, sort_key, bool(desc)), (value,))
+
+    def count_all(self) -> int:
         self._load()
-        _models = list(self._base.values())
-        models = []
-        for i in _models:
-            if i.dict(include={key})[key] == value:
-                models.append(i)
-        if sort_key:
-            models.sort(key=lambda j: j.dict(include={sort_key})[sort_key], reverse=desc)
-        return models
+        return len(self._base)
 
-    def remove(self, model):
+    def _matches(self, query: Query, values: tuple):
+        split = query.split(values)
+        if not self._native:
+            return (i for i in self._base.values() if query.match(i, split))
+        match, match_raw = query.match, query.match_raw
+        return (i for i in self._base.rows() if (match_raw if type(i) is dict else match)(i, split))
+
+    def _count_by(self, query: Query, values: tuple) -> int:
+        self._load()
+        return sum(1 for _ in self._matches(query, values))
+
+    def _exists_by(self, query: Query, values: tuple) -> bool:
+        self._load()
+        return next(self._matches(query, values), None) is not None
+
+    def _aggregate(self, aggregate: Aggregate):
         self._load()
-        self._base.pop(model.id)
-        self._save()
-        return model
+        return aggregate.run(self._base, self._columns)
+
+    def remove(self, model):
+        with self._file_lock(True):
+            self._load()
+            self._base.pop(model.id)
+            self._columns.invalidate(model.id)
+            self._save(removed=[model.id])
+            return model
+
+    def remove_all(self, models):
+        models = list(models)
+        with self._file_lock(True):
+            self._load()
+            self._check_removed(models)
+            for i in models:
+                self._base.pop(i.id, None)
+                self._columns.invalidate(i.id)
+            self._save(removed=[i.id for i in models])
+            return models
+
+    def _remove_by(self, query: Query, values: tuple) -> list[BaseModel]:
+        with self._file_lock(True):
+            self._load()
+            models = query.filter(self._base.values(), values)
+            for i in models:
+                self._base.pop(i.id)
+                self._columns.invalidate(i.id)
+            if models:
+                self._save(removed=[i.id for i in models])
+            return models
+
+    def remove_by(self, key: str, value) -> list[BaseModel]:
+        return self._remove_by(compile_query(self._model, key), (value,))
+
+
+@lru_cache(maxsize=None)
+def json_class(model: type[BaseModel]) -> type:
+    return type(Json.__name__, (Json,), {'_model': model})
 
 
 def abc2db_json(abc_class: type) -> type:
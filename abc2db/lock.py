@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
+
+
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting = 0
+
+    @contextmanager
+    def read(self):
+        if self._writer == threading.get_ident():
+            yield
+            return
+        with self._cond:
+            while self._writer is not None or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        ident = threading.get_ident()
+        with self._cond:
+            if self._writer == ident:
+                self._depth += 1
+            else:
+                self._waiting += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting -= 1
+                self._writer = ident
+                self._depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+class NoLock:
+    def read(self):
+        return nullcontext()
+
+    def write(self):
+        return nullcontext()
+
+
+class TransactionGate:
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._owner = ContextVar('owner', default=None)
+
+    def active(self) -> bool:
+        return self._owner.get() is self
+
+    async def wait(self):
+        if self._lock.locked() and not self.active():
+            async with self._lock:
+                pass
+
+    @asynccontextmanager
+    async def hold(self):
+        async with self._lock:
+            token = self._owner.set(self)
+            try:
+                yield
+            finally:
+                self._owner.reset(token)
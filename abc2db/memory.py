@@ -1,49 +1,259 @@
+import os
+import threading
+import warnings
+from contextlib import contextmanager
+
 from pydantic import BaseModel
 
 from .core import build_repository_impl, Repository
+from .aggregate import Aggregate, Columns
+from .codecs import Codec, get_codec
+from .compact import CompactBase
+from .json import json_native
+from .index import HashIndex, SortedIndex
+from .lock import NoLock, RWLock
+from .query import Query, Window, compile_query
+from .snapshot import MappedBase, read_snapshot, snapshot_state, write_snapshot
 
 
 class Memory(Repository):
-    def __init__(self):
-        self._base = {}
+    _model = BaseModel
+    _index_keys = ()
+    _sort_keys = ()
+
+    _self_add = ['_index', '_unindex', '_find_ids', '_original', '_track', '_touched', 'transaction',
+                 '_restore', '_periodic', '_write_snapshot', 'snapshot', 'close']
+
+    def __init__(self, compact: bool = False, thread_safe: bool = False, snapshot: [str] = None,
+                 snapshot_interval: [float] = None, snapshot_codec: [str, Codec] = 'json'):
+        self._base = CompactBase(self._model) if compact else {}
+        self._thread_safe = thread_safe or snapshot_interval is not None
+        self._lock = RWLock() if self._thread_safe else NoLock()
         self._id = 1
+        self._indexes = {key: HashIndex(key) for key in self._index_keys}
+        self._sort_indexes = {key: SortedIndex(key) for key in self._sort_keys}
+        self._columns = Columns(self._model)
+        self._deep_copy = not json_native(self._model)
+        self._undo = None
+        self._snapshot = snapshot
+        self._snapshot_codec = get_codec(snapshot_codec)
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_stop = threading.Event()
+        self._snapshot_thread = None
+        if snapshot is not None and os.path.exists(snapshot):
+            self._restore(snapshot)
+        if snapshot_interval is not None:
+            self._snapshot_thread = threading.Thread(target=self._periodic, args=(snapshot_interval,), daemon=True)
+            self._snapshot_thread.start()
+
+    def _restore(self, path):
+        self._id, base, indexes = read_snapshot(path, self._snapshot_codec, self._model)
+        if isinstance(self._base, CompactBase):
+            for uid in base:
+                self._base[uid] = base[uid]
+        else:
+            self._base = base
+        for key, index in self._indexes.items():
+            if key in indexes['hash']:
+                index.load(base.ids, indexes['hash'][key])
+            else:
+                for model in self._base.values():
+                    index.add(model)
+        for key, index in self._sort_indexes.items():
+            if key in indexes['sorted']:
+                index.load(base.ids, indexes['sorted'][key])
+            else:
+                for model in self._base.values():
+                    index.add(model)
+
+    def _periodic(self, interval: float):
+        while not self._snapshot_stop.wait(interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                warnings.warn(f'periodic snapshot failed: {e!r}', RuntimeWarning)
+
+    def _write_snapshot(self, path, state: tuple):
+        with self._snapshot_lock:
+            write_snapshot(path, self._snapshot_codec, self._model, state)
+
+    def snapshot(self, path: [str] = None, background: bool = False) -> [threading.Thread]:
+        path = path or self._snapshot
+        if path is None:
+            raise ValueError('snapshot path is not configured')
+        with self._lock.read():
+            state = snapshot_state(self._base, self._model, self._id, self._indexes, self._sort_indexes)
+        if not background:
+            self._write_snapshot(path, state)
+            return None
+        thread = threading.Thread(target=self._write_snapshot, args=(path, state))
+        thread.start()
+        return thread
+
+    def close(self):
+        self._snapshot_stop.set()
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        if self._snapshot is not None:
+            self.snapshot()
+
+    def _index(self, model):
+        self._columns.invalidate(model.id)
+        for index in self._indexes.values():
+            index.add(model)
+        for index in self._sort_indexes.values():
+            index.add(model)
+
+    def _unindex(self, _id):
+        self._columns.invalidate(_id)
+        for index in self._indexes.values():
+            index.remove(_id)
+        for index in self._sort_indexes.values():
+            index.remove(_id)
+
+    def _original(self, _id) -> [BaseModel]:
+        model = self._base.original(_id) if isinstance(self._base, MappedBase) else self._base.get(_id)
+        return None if model is None else model.copy(deep=self._deep_copy)
+
+    def _track(self, _id):
+        if self._undo is not None and _id not in self._undo:
+            self._undo[_id] = self._original(_id)
+
+    def _touched(self, models):
+        if self._undo is None:
+            return models
+        models = list(models)
+        for i in models:
+            self._track(i.id)
+        return models
+
+    @contextmanager
+    def transaction(self):
+        """rows are copied on their first read or write inside the block and restored on error;
+        models fetched before the block and changed in place are restored to their state at that first touch"""
+        with self._lock.write():
+            if self._undo is not None:
+                yield self
+                return
+            self._undo = {}
+            next_id = self._id
+            try:
+                yield self
+            except BaseException:
+                undo, self._undo = self._undo, None
+                self._id = next_id
+                for _id, model in undo.items():
+                    if model is None:
+                        self._base.pop(_id, None)
+                        self._unindex(_id)
+                    else:
+                        self._base[_id] = model
+                        self._index(model)
+                raise
+            self._undo = None
+
+    def _find_ids(self, query: Query, values: tuple) -> list:
+        plan = query.plan(values, self._indexes, self._sort_indexes)
+        if plan is None:
+            split = query.split(values)
+            return [k for k, v in self._base.items() if query.match(v, split)]
+        ids, split = plan
+        if len(split) == 1:
+            return ids
+        return [i for i in ids if query.match(self._base[i], split)]
 
     def find(self, _id):
-        return self._base.get(_id)
+        with self._lock.read():
+            if self._undo is not None:
+                self._track(_id)
+            return self._base.get(_id)
 
     def save(self, model):
-        if model.id is None:
-            model.id = self._id
-            self._id += 1
-        self._base[model.id] = model
-        if model.id >= self._id:
-            self._id = model.id + 1
-        return model
+        with self._lock.write():
+            if model.id is None:
+                model.id = self._id
+                self._id += 1
+            self._track(model.id)
+            self._base[model.id] = model
+            self._index(model)
+            if model.id >= self._id:
+                self._id = model.id + 1
+            return model
 
     def save_all(self, models):
-        return [
-            self.save(i) for i in models
-        ]
+        with self._lock.write():
+            return [
+                self.save(i) for i in models
+            ]
+
+    def _find_all(self, query: Query, window: [Window] = None):
+        with self._lock.read():
+            if query.sort_key in self._sort_indexes:
+                ids = self._sort_indexes[query.sort_key].iter(query.desc, query.start(window))
+                models = query.slice((self._base[i] for i in ids), window)
+                return self._touched(list(models) if self._thread_safe else models)
+            return self._touched(query.select(self._base.values(), window))
 
     def find_all(self, sort_key: [str] = None, desc: bool = False) -> list[BaseModel]:
-        models = list(self._base.values())
-        if sort_key:
-            models.sort(key=lambda i: i.dict(include={sort_key})[sort_key], reverse=desc)
-        return models
+        return list(self._find_all(compile_query(self._model, sort_key=sort_key, desc=desc)))
+
+    def _find_by(self, query: Query, values: tuple, window: [Window] = None):
+        with self._lock.read():
+            ids = self._find_ids(query, values)
+            if window is None and query.sort_key in self._sort_indexes:
+                return self._touched([self._base[i] for i in self._sort_indexes[query.sort_key].sort(ids, query.desc)])
+            return self._touched(query.select((self._base[i] for i in ids), window))
 
     def find_by(self, key: str, value, sort_key: [str] = None, desc: [bool] = None) -> list[BaseModel]:
-        _models = list(self._base.values())
-        models = []
-        for i in _models:
-            if i.dict(include={key})[key] == value:
-                models.append(i)
-        if sort_key:
-            models.sort(key=lambda j: j.dict(include={sort_key})[sort_key], reverse=desc)
-        return models
+        return list(self._find_by(compile_query(self._model, key, sort_key, bool(desc)), (value,)))
+
+    def count_all(self) -> int:
+        return len(self._base)
+
+    def _count_by(self, query: Query, values: tuple) -> int:
+        with self._lock.read():
+            count = query.count(values, self._indexes, self._sort_indexes)
+            return len(self._find_ids(query, values)) if count is None else count
+
+    def _exists_by(self, query: Query, values: tuple) -> bool:
+        with self._lock.read():
+            count = query.count(values, self._indexes, self._sort_indexes)
+            return query.exists(self._base.values(), values) if count is None else count > 0
+
+    def _aggregate(self, aggregate: Aggregate):
+        with self._lock.write():
+            return aggregate.run(self._base, self._columns)
 
     def remove(self, model):
-        self._base.pop(model.id)
-        return model
+        with self._lock.write():
+            self._track(model.id)
+            self._base.pop(model.id)
+            self._unindex(model.id)
+            return model
+
+    def remove_all(self, models):
+        models = list(models)
+        with self._lock.write():
+            for i in models:
+                if i.id not in self._base:
+                    raise KeyError(i.id)
+            for i in models:
+                self._track(i.id)
+                self._base.pop(i.id, None)
+                self._unindex(i.id)
+            return models
+
+    def _remove_by(self, query: Query, values: tuple) -> list[BaseModel]:
+        models = []
+        with self._lock.write():
+            for i in self._find_ids(query, values):
+                self._track(i)
+                models.append(self._base.pop(i))
+                self._unindex(i)
+            return models
+
+    def remove_by(self, key: str, value) -> list[BaseModel]:
+        return self._remove_by(compile_query(self._model, key), (value,))
 
 
 def abc2db_memory(abc_class: type) -> type:
@@ -0,0 +1,340 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from operator import attrgetter
+
+from pydantic import BaseModel
+
+from .aggregate import Aggregate, Columns
+from .codecs import Codec, get_codec
+from .core import build_repository_impl, Repository
+from .index import HashIndex, SortedIndex, sort_value
+from .json import FORMAT_VERSION, json_class, json_native, native_field, plain, schema_fingerprint, write_atomic
+from .query import Query, Window, compile_query
+
+MAGIC = b'ABC2DB:mmap\n'
+HEADER = struct.Struct('<Q')
+
+
+def hash_key(value) -> bytes:
+    if type(value) is float and value.is_integer():
+        value = int(value)
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str).encode()
+
+
+def pack(items: list[bytes]) -> tuple[bytes, bytes]:
+    offsets = array('q', [0])
+    for i in items:
+        offsets.append(offsets[-1] + len(i))
+    return offsets.tobytes(), b''.join(items)
+
+
+class Packed(Sequence):
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i) -> bytes:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]])
+
+
+class Entries(Sequence):
+    def __init__(self, codec: Codec, ids, values: Packed, parse=None):
+        self._codec = codec
+        self._ids = ids
+        self._values = values
+        self._parse = parse or (lambda i: i)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, i) -> tuple:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return sort_value(self._parse(self._codec.loads(self._values[i]))), self._ids[i]
+
+
+class Buckets(Mapping):
+    def __init__(self, keys: Packed, starts, postings):
+        self._keys = keys
+        self._starts = starts
+        self._postings = postings
+
+    def __getitem__(self, value):
+        key = hash_key(value)
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            raise KeyError(value)
+        return self._postings[self._starts[i]:self._starts[i + 1]]
+
+    def __iter__(self):
+        return (json.loads(i) for i in self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class MappedHashIndex(HashIndex):
+    def __init__(self, key: str, buckets: Buckets):
+        super().__init__(key)
+        self._buckets = buckets
+
+
+class MappedSortedIndex(SortedIndex):
+    def __init__(self, key: str, entries: Entries, ids, ranks, slot):
+        super().__init__(key)
+        self._entries = entries
+        self._ids = ids
+        self._ranks = ranks
+        self._slot = slot
+
+    def range(self, op: str, args: tuple) -> list:
+        start, end = self.span(op, args)
+        return list(self._ids[start:end]) if start < end else []
+
+    def sort(self, ids, desc: bool = False) -> list:
+        ids = sorted(ids)
+        ids.sort(key=lambda i: self._ranks[self._slot(i)], reverse=desc)
+        return ids
+
+
+class MmapBase(Mapping):
+    def __init__(self, parse, codec: Codec, ids, records: Packed):
+        self._parse = parse
+        self._codec = codec
+        self._ids = ids
+        self._records = records
+
+    def slot(self, uid) -> int:
+        i = bisect_left(self._ids, uid)
+        if i == len(self._ids) or self._ids[i] != uid:
+            raise KeyError(uid)
+        return i
+
+    def __getitem__(self, uid) -> BaseModel:
+        return self._parse(self._codec.loads(self._records[self.slot(uid)]))
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, uid) -> bool:
+        try:
+            self.slot(uid)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def values(self):
+        loads, parse = self._codec.loads, self._parse
+        return (parse(loads(i)) for i in self._records)
+
+
+def write_mmap(path, model: type[BaseModel], models, index_keys=(), sort_keys=(), codec: [str, Codec] = 'json'):
+    codec = get_codec(codec)
+    models = sorted(models, key=attrgetter('id'))
+    dump = (lambda i: i.__dict__) if json_native(model) else plain
+    slots = {i.id: n for n, i in enumerate(models)}
+    sections = {'ids': array('q', slots).tobytes()}
+    sections['offsets'], sections['records'] = pack([codec.dumps(dump(i)) for i in models])
+    for key in index_keys:
+        buckets = {}
+        for i in models:
+            buckets.setdefault(hash_key(getattr(i, key)), []).append(i.id)
+        keys = sorted(buckets)
+        starts = array('q', [0])
+        postings = array('q')
+        for k in keys:
+            postings.extend(buckets[k])
+            starts.append(len(postings))
+        sections[f'hash.{key}.offsets'], sections[f'hash.{key}.keys'] = pack(keys)
+        sections[f'hash.{key}.starts'] = starts.tobytes()
+        sections[f'hash.{key}.postings'] = postings.tobytes()
+    for key in sort_keys:
+        get = attrgetter(key)
+        encode = (lambda i: i) if native_field(model.__fields__[key]) else plain
+        order = sorted(models, key=lambda i: (sort_value(get(i)), i.id))
+        ranks = array('q', bytes(8 * len(models)))
+        rank, last = -1, None
+        for i in order:
+            if rank < 0 or sort_value(get(i)) != last:
+                rank, last = rank + 1, sort_value(get(i))
+            ranks[slots[i.id]] = rank
+        sections[f'sorted.{key}.ids'] = array('q', [i.id for i in order]).tobytes()
+        sections[f'sorted.{key}.offsets'], sections[f'sorted.{key}.values'] = pack(
+            [codec.dumps(encode(get(i))) for i in order]
+        )
+        sections[f'sorted.{key}.ranks'] = ranks.tobytes()
+    layout = {}
+    position = 0
+    for name, data in sections.items():
+        layout[name] = [position, len(data)]
+        position += len(data) + -len(data) % 8
+    header = json.dumps({
+        'version': FORMAT_VERSION,
+        'codec': codec.name,
+        'schema': schema_fingerprint(model),
+        'next_id': models[-1].id + 1 if models else 1,
+        'hash': list(index_keys),
+        'sorted': list(sort_keys),
+        'sections': layout
+    }).encode()
+    header += b' ' * (-(len(MAGIC) + HEADER.size + len(header)) % 8)
+    write_atomic(path, b''.join(
+        [MAGIC, HEADER.pack(len(header)), header] + [i + bytes(-len(i) % 8) for i in sections.values()]
+    ))
+
+
+def build_mmap(abc_class: type, source, path, codec: [str, Codec] = 'json', source_codec: [str, Codec] = 'json'):
+    repository = abc2db_mmap(abc_class)
+    reader = json_class(repository._model)(
+        source, journal=os.path.exists(source + '.journal'), codec=source_codec
+    )
+    reader._load()
+    write_mmap(path, repository._model, reader._base.values(), repository._index_keys, repository._sort_keys, codec)
+
+
+class Mmap(Repository):
+    _model = BaseModel
+    _index_keys = ()
+    _sort_keys = ()
+
+    _self_add = ['_section', '_value_parser', '_find_ids', '_read_only']
+
+    def __init__(self, path, codec: [str, Codec] = 'json'):
+        with open(path, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an abc2db mmap file')
+        size, = HEADER.unpack_from(self._data, len(MAGIC))
+        start = len(MAGIC) + HEADER.size
+        header = json.loads(self._data[start:start + size])
+        if header.get('version') != FORMAT_VERSION:
+            raise ValueError(f'unsupported mmap file version {header.get("version")!r}')
+        if header['schema'] != schema_fingerprint(self._model):
+            raise ValueError(f'{path} was built for a different {self._model.__name__} schema')
+        codec = get_codec(codec)
+        if header['codec'] != codec.name:
+            if header['codec'] == 'pickle':
+                raise ValueError('refusing to load a pickle mmap file without codec="pickle"')
+            codec = get_codec(header['codec'])
+        self._view = memoryview(self._data)[start + size:]
+        self._layout = header['sections']
+        ids = self._section('ids', 'q')
+        self._base = MmapBase(
+            (lambda i: self._model.construct(**i)) if json_native(self._model) else self._model.parse_obj, codec, ids,
+            Packed(self._section('offsets', 'q'), self._section('records'))
+        )
+        self._indexes = {
+            key: MappedHashIndex(key, Buckets(
+                Packed(self._section(f'hash.{key}.offsets', 'q'), self._section(f'hash.{key}.keys')),
+                self._section(f'hash.{key}.starts', 'q'),
+                self._section(f'hash.{key}.postings', 'q')
+            ))
+            for key in self._index_keys if key in header['hash']
+        }
+        self._sort_indexes = {
+            key: MappedSortedIndex(
+                key,
+                Entries(codec, self._section(f'sorted.{key}.ids', 'q'), Packed(
+                    self._section(f'sorted.{key}.offsets', 'q'), self._section(f'sorted.{key}.values')
+                ), self._value_parser(key)),
+                self._section(f'sorted.{key}.ids', 'q'),
+                self._section(f'sorted.{key}.ranks', 'q'),
+                self._base.slot
+            )
+            for key in self._sort_keys if key in header['sorted']
+        }
+        self._columns = Columns(self._model)
+
+    def _section(self, name: str, fmt: [str] = None) -> memoryview:
+        start, size = self._layout[name]
+        view = self._view[start:start + size]
+        return view.cast(fmt) if fmt else view
+
+    def _value_parser(self, key: str):
+        field = self._model.__fields__[key]
+        if native_field(field):
+            return None
+        return lambda value: field.validate(value, {}, loc=key)[0]
+
+    def _read_only(self, *args):
+        raise TypeError(f'{type(self).__name__} is read-only')
+
+    def _find_ids(self, query: Query, values: tuple) -> list:
+        plan = query.plan(values, self._indexes, self._sort_indexes)
+        if plan is None:
+            split = query.split(values)
+            return [k for k, v in self._base.items() if query.match(v, split)]
+        ids, split = plan
+        if len(split) == 1:
+            return ids
+        return [i for i in ids if query.match(self._base[i], split)]
+
+    def find(self, _id):
+        return self._base.get(_id)
+
+    def save(self, model):
+        self._read_only()
+
+    def save_all(self, models):
+        self._read_only()
+
+    def _find_all(self, query: Query, window: [Window] = None):
+        if query.sort_key in self._sort_indexes:
+            ids = self._sort_indexes[query.sort_key].iter(query.desc, query.start(window))
+            return query.slice((self._base[i] for i in ids), window)
+        return query.select(self._base.values(), window)
+
+    def find_all(self, sort_key: [str] = None, desc: bool = False):
+        return list(self._find_all(compile_query(self._model, sort_key=sort_key, desc=desc)))
+
+    def _find_by(self, query: Query, values: tuple, window: [Window] = None):
+        ids = self._find_ids(query, values)
+        if window is None and query.sort_key in self._sort_indexes:
+            return [self._base[i] for i in self._sort_indexes[query.sort_key].sort(ids, query.desc)]
+        return query.select((self._base[i] for i in ids), window)
+
+    def find_by(self, key: str, value, sort_key: [str] = None, desc: [bool] = None):
+        return list(self._find_by(compile_query(self._model, key, sort_key, bool(desc)), (value,)))
+
+    def count_all(self) -> int:
+        return len(self._base)
+
+    def _count_by(self, query: Query, values: tuple) -> int:
+        count = query.count(values, self._indexes, self._sort_indexes)
+        return len(self._find_ids(query, values)) if count is None else count
+
+    def _exists_by(self, query: Query, values: tuple) -> bool:
+        count = query.count(values, self._indexes, self._sort_indexes)
+        return query.exists(self._base.values(), values) if count is None else count > 0
+
+    def _aggregate(self, aggregate: Aggregate):
+        return aggregate.run(self._base, self._columns)
+
+    def remove(self, model):
+        self._read_only()
+
+    def remove_all(self, models):
+        self._read_only()
+
+    def _remove_by(self, query: Query, values: tuple):
+        self._read_only()
+
+    def remove_by(self, key: str, value):
+        self._read_only()
+
+
+def abc2db_mmap(abc_class: type) -> type:
+    return build_repository_impl(abc_class, Mmap)
@@ -0,0 +1,258 @@
+import heapq
+import re
+from functools import lru_cache
+from itertools import islice
+from operator import attrgetter, itemgetter
+from typing import NamedTuple
+
+from pydantic import BaseModel
+
+from .index import sort_value
+
+_PAGING = re.compile(r'_(limit|page)(?:_(\d+))?$')
+
+OPERATORS = {
+    'eq': 1,
+    'in': 1,
+    'gt': 1,
+    'gte': 1,
+    'lt': 1,
+    'lte': 1,
+    'between': 2,
+}
+RANGES = {'gt', 'gte', 'lt', 'lte', 'between'}
+
+
+def test(op: str, value, args: tuple) -> bool:
+    if op == 'eq':
+        return value == args[0]
+    if op == 'in':
+        return value in args[0]
+    if value is None:
+        return False
+    if op == 'gt':
+        return value > args[0]
+    if op == 'gte':
+        return value >= args[0]
+    if op == 'lt':
+        return value < args[0]
+    if op == 'lte':
+        return value <= args[0]
+    return args[0] <= value <= args[1]
+
+
+class Window(NamedTuple):
+    limit: [int] = None
+    offset: int = 0
+    after: [BaseModel] = None
+
+
+class Query:
+    batch = 256
+
+    def __init__(self, model: type[BaseModel], by_key: [str] = None, sort_key: [str] = None, desc: bool = False,
+                 limit: [int] = None, paging: [str] = None, lazy: bool = False, predicates: tuple = ()):
+        if by_key is not None:
+            predicates = ((by_key, 'eq'),) + predicates
+        if paging == 'page' and sort_key is None:
+            sort_key = 'id'
+        for key in [i[0] for i in predicates] + [sort_key]:
+            if key is not None and key not in model.__fields__:
+                raise ValueError(f'{model.__name__} has no field {key!r}')
+        self.predicates = predicates
+        self.arity = sum(OPERATORS[op] for _, op in predicates)
+        self.sort_key = sort_key
+        self.desc = desc
+        self.limit = limit
+        self.paging = paging
+        self.lazy = lazy
+        self._getters = [attrgetter(key) for key, _ in predicates]
+        self._raw_getters = [itemgetter(key) for key, _ in predicates]
+        self.sort = None
+        self.position = None
+        if sort_key:
+            get_sort = attrgetter(sort_key)
+            if desc:
+                self.sort = lambda i: (sort_value(get_sort(i)), -i.id)
+            else:
+                self.sort = lambda i: (sort_value(get_sort(i)), i.id)
+            self.position = lambda i: (sort_value(get_sort(i)), i.id)
+
+    def bind(self, args: tuple) -> tuple[tuple, [Window]]:
+        if self.paging is None:
+            return args, None
+        values, args = args[:self.arity], args[self.arity:]
+        if self.limit is None:
+            limit, args = args[0], args[1:]
+        else:
+            limit = self.limit
+        if self.paging == 'page':
+            return values, Window(limit, 0, *args)
+        return values, Window(limit, *args)
+
+    def split(self, values: tuple) -> list[tuple]:
+        split = []
+        for key, op in self.predicates:
+            size = OPERATORS[op]
+            split.append((key, op, values[:size]))
+            values = values[size:]
+        return split
+
+    def match(self, model: BaseModel, split: list[tuple]) -> bool:
+        for get, (_, op, args) in zip(self._getters, split):
+            if not test(op, get(model), args):
+                return False
+        return True
+
+    def match_raw(self, row: dict, split: list[tuple]) -> bool:
+        for get, (_, op, args) in zip(self._raw_getters, split):
+            if not test(op, get(row), args):
+                return False
+        return True
+
+    def filter(self, models, values: tuple) -> list:
+        split = self.split(values)
+        if len(split) == 1 and split[0][1] == 'eq':
+            get, value = self._getters[0], split[0][2][0]
+            return [i for i in models if get(i) == value]
+        return [i for i in models if self.match(i, split)]
+
+    def cost(self, key: str, op: str, args: tuple, indexes: dict, sort_indexes: dict) -> [int]:
+        if op == 'eq' and key in indexes:
+            return indexes[key].count(args[0])
+        if op == 'in' and key in indexes:
+            return sum(indexes[key].count(i) for i in set(args[0]))
+        if op in RANGES and key in sort_indexes:
+            start, end = sort_indexes[key].span(op, args)
+            return max(end - start, 0)
+        return None
+
+    def count(self, values: tuple, indexes: dict, sort_indexes: dict) -> [int]:
+        split = self.split(values)
+        if len(split) != 1:
+            return None
+        return self.cost(*split[0], indexes, sort_indexes)
+
+    def plan(self, values: tuple, indexes: dict, sort_indexes: dict) -> [tuple]:
+        best = None
+        split = self.split(values)
+        for key, op, args in split:
+            cost = self.cost(key, op, args, indexes, sort_indexes)
+            if cost is not None and (best is None or cost < best[0]):
+                best = (cost, key, op, args)
+        if best is None:
+            return None
+        _, key, op, args = best
+        if op == 'eq':
+            return indexes[key].find(args[0]), split
+        if op == 'in':
+            return sorted({i for value in args[0] for i in indexes[key].find(value)}), split
+        return sorted(sort_indexes[key].range(op, args)), split
+
+    def exists(self, models, values: tuple) -> bool:
+        split = self.split(values)
+        return any(self.match(i, split) for i in models)
+
+    def order(self, models: list) -> list:
+        if self.sort:
+            models.sort(key=self.sort, reverse=self.desc)
+        return models
+
+    def start(self, window: [Window]) -> [tuple]:
+        if window is None or window.after is None:
+            return None
+        return self.position(window.after)
+
+    def is_after(self, model: BaseModel, position: tuple) -> bool:
+        value, _id = self.position(model)
+        if self.desc:
+            return value < position[0] or (value == position[0] and _id > position[1])
+        return (value, _id) > position
+
+    def select(self, models, window: [Window] = None) -> list:
+        if window is None:
+            return self.order(list(models))
+        limit, offset, after = window
+        if after is not None:
+            position = self.position(after)
+            models = (i for i in models if self.is_after(i, position))
+        if self.sort and limit is not None:
+            top = heapq.nlargest if self.desc else heapq.nsmallest
+            return top(offset + limit, models, key=self.sort)[offset:]
+        return list(self.slice(self.order(list(models)), window))
+
+    def slice(self, models, window: [Window] = None):
+        if window is None:
+            return models
+        return islice(models, window.offset, None if window.limit is None else window.offset + window.limit)
+
+
+@lru_cache(maxsize=None)
+def compile_query(model: type[BaseModel], by_key: [str] = None, sort_key: [str] = None, desc: bool = False,
+                  limit: [int] = None, paging: [str] = None, lazy: bool = False, predicates: tuple = ()) -> Query:
+    return Query(model, by_key, sort_key, desc, limit, paging, lazy, predicates)
+
+
+def parse_predicates(fields: list[str], name: str) -> [tuple]:
+    for field in fields:
+        if not name.startswith(field):
+            continue
+        rest = name[len(field):]
+        for op in OPERATORS:
+            suffix = '' if op == 'eq' else '_' + op
+            if not rest.startswith(suffix):
+                continue
+            tail = rest[len(suffix):]
+            if not tail:
+                return ((field, op),)
+            if tail.startswith('_and_'):
+                predicates = parse_predicates(fields, tail[len('_and_'):])
+                if predicates:
+                    return ((field, op),) + predicates
+    return None
+
+
+def strip_suffix(step: str, name: str) -> [tuple[str, dict]]:
+    if step == 'iter':
+        return (name[:-len('_iter')], {'lazy': True}) if name.endswith('_iter') else None
+    if step == 'desc':
+        return (name[:-len('_desc')], {'desc': True}) if name.endswith('_desc') else None
+    paging = _PAGING.search(name)
+    if not paging:
+        return None
+    vals = {'paging': paging.group(1)}
+    if paging.group(2):
+        vals['limit'] = int(paging.group(2))
+    return name[:paging.start()], vals
+
+
+def parse_body(model: type[BaseModel], name: str, vals: dict) -> Query:
+    if '_sort_by_' in name:
+        name, vals['sort_key'] = name.split('_sort_by_', 1)
+    for prefix in ('find_by_', 'remove_by_', 'count_by_', 'exists_by_'):
+        if name.startswith(prefix):
+            fields = sorted(model.__fields__, key=len, reverse=True)
+            vals['predicates'] = parse_predicates(fields, name[len(prefix):])
+            if vals['predicates'] is None:
+                raise ValueError(f'{model.__name__} has no fields matching {name[len(prefix):]!r}')
+            break
+    else:
+        if name != 'find_all':
+            raise ValueError(f'cannot parse query method {name!r}')
+    return compile_query(model, **vals)
+
+
+def _parse_query(model: type[BaseModel], name: str, vals: dict, steps: tuple) -> Query:
+    if not steps:
+        return parse_body(model, name, dict(vals))
+    stripped = strip_suffix(steps[0], name)
+    if stripped is not None:
+        try:
+            return _parse_query(model, stripped[0], {**vals, **stripped[1]}, steps[1:])
+        except ValueError:
+            pass
+    return _parse_query(model, name, vals, steps[1:])
+
+
+def parse_query(model: type[BaseModel], name: str) -> Query:
+    return _parse_query(model, name, {}, ('iter', 'paging', 'desc'))
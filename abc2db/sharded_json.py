@@ -0,0 +1,156 @@
+import json
+import os
+import re
+import threading
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from operator import attrgetter
+
+from pydantic import BaseModel
+
+from .aggregate import Aggregate, Columns
+from .codecs import encode, get_codec
+from .core import build_repository_impl, Repository
+from .json import Json, json_class, write_atomic
+from .query import Query, Window, compile_query
+
+
+class ShardedJson(Repository):
+    _model = BaseModel
+
+    _self_add = ['_shard', '_group', '_reserve', '_map', '_merge', '_insert', '_delete', 'close']
+
+    def __init__(self, path, shards: int = 16, workers: [int] = None, **kwargs):
+        os.makedirs(path, exist_ok=True)
+        self._manifest = os.path.join(path, 'shards.meta')
+        manifest = None
+        if os.path.exists(self._manifest):
+            with open(self._manifest) as file:
+                manifest = json.loads(file.read())
+            count = manifest['shards']
+        else:
+            count = sum(re.fullmatch(r'shard_\d+\.json', i) is not None for i in os.listdir(path)) or shards
+        if count != shards:
+            raise ValueError(f'{path} was written with {count} shards, not {shards}')
+        shard_json = json_class(self._model)
+        codec = get_codec(kwargs.get('codec', 'json'))
+        self._shards = []
+        for i in range(shards):
+            shard = os.path.join(path, f'shard_{i}.json')
+            if not os.path.exists(shard):
+                with open(shard, 'wb') as file:
+                    file.write(encode(codec, {}))
+            self._shards.append(shard_json(shard, **kwargs))
+        self._executor = ThreadPoolExecutor(workers or min(shards, 8))
+        self._columns = Columns(self._model)
+        self._stamps = None
+        self._id_lock = threading.Lock()
+        if manifest is None:
+            self._map(Json._load)
+            write_atomic(self._manifest, json.dumps({
+                'shards': shards, 'next_id': max(i._id for i in self._shards)
+            }).encode())
+
+    def _shard(self, _id) -> Json:
+        return self._shards[_id % len(self._shards)]
+
+    def _group(self, models) -> dict:
+        groups = {}
+        for i in models:
+            groups.setdefault(self._shard(i.id), []).append(i)
+        return groups
+
+    def _reserve(self, models: list):
+        with self._id_lock:
+            with open(self._manifest) as file:
+                manifest = json.loads(file.read())
+            _id = manifest['next_id']
+            for i in models:
+                if i.id is None:
+                    i.id = _id
+                _id = max(_id, i.id + 1)
+            if _id != manifest['next_id']:
+                manifest['next_id'] = _id
+                write_atomic(self._manifest, json.dumps(manifest).encode())
+
+    def _map(self, func) -> list:
+        return list(self._executor.map(func, self._shards))
+
+    def _merge(self, query: Query, parts: list, window: [Window] = None) -> list[BaseModel]:
+        models = chain.from_iterable(parts)
+        if query.sort is None:
+            models = sorted(models, key=attrgetter('id'))
+        return query.select(models, window)
+
+    def _insert(self, models: list) -> list:
+        self._reserve(models)
+        for shard, group in self._group(models).items():
+            shard.save_all(group)
+        return models
+
+    def _delete(self, models: list) -> list:
+        groups = self._group(models)
+        for shard, group in groups.items():
+            shard._load()
+            shard._check_removed(group)
+        for shard, group in groups.items():
+            shard.remove_all(group)
+        return models
+
+    def close(self):
+        self._executor.shutdown()
+
+    def find(self, _id):
+        return self._shard(_id).find(_id)
+
+    def save(self, model):
+        return self._insert([model])[0]
+
+    def save_all(self, models):
+        return self._insert(list(models))
+
+    def _find_all(self, query: Query, window: [Window] = None) -> list[BaseModel]:
+        return self._merge(query, self._map(lambda shard: list(shard._find_all(query))), window)
+
+    def find_all(self, sort_key: [str] = None, desc: bool = False) -> list[BaseModel]:
+        return self._find_all(compile_query(self._model, sort_key=sort_key, desc=desc))
+
+    def _find_by(self, query: Query, values: tuple, window: [Window] = None) -> list[BaseModel]:
+        return self._merge(query, self._map(lambda shard: shard._find_by(query, values)), window)
+
+    def find_by(self, key: str, value, sort_key: [str] = None, desc: [bool] = None) -> list[BaseModel]:
+        return self._find_by(compile_query(self._model, key, sort_key, bool(desc)), (value,))
+
+    def count_all(self) -> int:
+        return sum(self._map(Json.count_all))
+
+    def _count_by(self, query: Query, values: tuple) -> int:
+        return sum(self._map(lambda shard: shard._count_by(query, values)))
+
+    def _exists_by(self, query: Query, values: tuple) -> bool:
+        return any(self._map(lambda shard: shard._exists_by(query, values)))
+
+    def _aggregate(self, aggregate: Aggregate):
+        self._map(Json._load)
+        stamps = [i._stamp for i in self._shards]
+        if stamps != self._stamps:
+            self._columns.clear()
+            self._stamps = stamps
+        return aggregate.run(ChainMap(*(i._base for i in self._shards)), self._columns)
+
+    def remove(self, model):
+        return self._shard(model.id).remove(model)
+
+    def remove_all(self, models):
+        return self._delete(list(models))
+
+    def _remove_by(self, query: Query, values: tuple) -> list[BaseModel]:
+        return self._merge(query, self._map(lambda shard: shard._remove_by(query, values)))
+
+    def remove_by(self, key: str, value) -> list[BaseModel]:
+        return self._remove_by(compile_query(self._model, key), (value,))
+
+
+def abc2db_sharded_json(abc_class: type) -> type:
+    return build_repository_impl(abc_class, ShardedJson)
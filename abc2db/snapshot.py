@@ -0,0 +1,131 @@
+import json
+import mmap
+import struct
+from array import array
+from collections.abc import MutableMapping
+
+from pydantic import BaseModel
+
+from .codecs import Codec, get_codec
+from .json import FORMAT_VERSION, json_native, native_field, plain, schema_fingerprint, write_atomic
+
+MAGIC = b'ABC2DB:snapshot\n'
+HEADER = struct.Struct('<QQQ')
+
+
+class MappedBase(MutableMapping):
+    def __init__(self, parse, codec: Codec, data, start: int, ids: array, offsets: array):
+        self.codec = codec
+        self.ids = ids
+        self._parse = parse
+        self._data = data
+        self._start = start
+        self._offsets = offsets
+        self._items = dict(zip(ids, range(len(ids))))
+        self._models = {}
+
+    def record(self, slot: int) -> bytes:
+        return self._data[self._start + self._offsets[slot]:self._start + self._offsets[slot + 1]]
+
+    def decode(self, slot: int) -> dict:
+        return self.codec.loads(self.record(slot))
+
+    def slots(self) -> list:
+        return list(self._items.items())
+
+    def original(self, uid) -> [BaseModel]:
+        value = self._items.get(uid)
+        return self._parse(self.decode(value)) if type(value) is int else value
+
+    def __getitem__(self, uid) -> BaseModel:
+        value = self._items[uid]
+        if type(value) is not int:
+            return value
+        model = self._models.get(uid)
+        if model is None:
+            model = self._models[uid] = self._parse(self.decode(value))
+        return model
+
+    def __setitem__(self, uid, model: BaseModel):
+        self._items[uid] = model
+        self._models.pop(uid, None)
+
+    def __delitem__(self, uid):
+        del self._items[uid]
+        self._models.pop(uid, None)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, uid) -> bool:
+        return uid in self._items
+
+
+def snapshot_state(base, model: type[BaseModel], next_id: int, indexes: dict, sort_indexes: dict) -> tuple:
+    mapped = base if isinstance(base, MappedBase) else None
+    dump = (lambda i: i.__dict__.copy()) if json_native(model) else plain
+    items = [(k, v if type(v) is int else dump(v)) for k, v in (base.slots() if mapped else base.items())]
+    return mapped, next_id, items, \
+        {k: dict(v._values) for k, v in indexes.items()}, {k: dict(v._values) for k, v in sort_indexes.items()}
+
+
+def write_snapshot(path, codec: Codec, model: type[BaseModel], state: tuple):
+    mapped, next_id, items, hashes, sorts = state
+    reuse = mapped is not None and mapped.codec.name == codec.name
+    ids = array('q')
+    offsets = array('q', [0])
+    records = []
+    for uid, value in items:
+        if type(value) is not int:
+            record = codec.dumps(value)
+        elif reuse:
+            record = mapped.record(value)
+        else:
+            record = codec.dumps(mapped.decode(value))
+        ids.append(uid)
+        offsets.append(offsets[-1] + len(record))
+        records.append(record)
+    meta = json.dumps({
+        'version': FORMAT_VERSION,
+        'codec': codec.name,
+        'schema': schema_fingerprint(model),
+        'next_id': next_id
+    }).encode()
+    fields = model.__fields__
+    index = codec.dumps({
+        'hash': {k: [v.get(i) for i in ids] for k, v in hashes.items() if native_field(fields[k])},
+        'sorted': {k: [v[i][1] if i in v else None for i in ids] for k, v in sorts.items() if native_field(fields[k])}
+    })
+    write_atomic(path, b''.join([
+        MAGIC, HEADER.pack(len(meta), len(index), len(ids)), meta, index, ids.tobytes(), offsets.tobytes()
+    ] + records))
+
+
+def read_snapshot(path, codec: Codec, model: type[BaseModel]) -> tuple[int, MappedBase, dict]:
+    with open(path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not an abc2db snapshot')
+    meta_size, index_size, count = HEADER.unpack_from(data, len(MAGIC))
+    start = len(MAGIC) + HEADER.size
+    meta = json.loads(data[start:start + meta_size])
+    if meta.get('version') != FORMAT_VERSION:
+        raise ValueError(f'unsupported snapshot version {meta.get("version")!r}')
+    if meta['schema'] != schema_fingerprint(model):
+        raise ValueError(f'snapshot {path} was written for a different {model.__name__} schema')
+    if meta['codec'] != codec.name:
+        if meta['codec'] == 'pickle':
+            raise ValueError('refusing to load a pickle snapshot without codec="pickle"')
+        codec = get_codec(meta['codec'])
+    start += meta_size
+    indexes = codec.loads(data[start:start + index_size])
+    start += index_size
+    ids = array('q', data[start:start + count * 8])
+    start += count * 8
+    offsets = array('q', data[start:start + (count + 1) * 8])
+    start += (count + 1) * 8
+    parse = (lambda i: model.construct(**i)) if json_native(model) else model.parse_obj
+    return meta['next_id'], MappedBase(parse, codec, data, start, ids, offsets), indexes
@@ -0,0 +1,280 @@
+import json
+import sqlite3
+from functools import lru_cache
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON, ModelField
+from pydantic.json import pydantic_encoder
+
+from .aggregate import Aggregate
+from .core import build_repository_impl, Repository
+from .query import RANGES, Query, Window, compile_query, parse_query
+
+SQL_TYPES = {
+    bool: 'INTEGER',
+    int: 'INTEGER',
+    float: 'REAL',
+    str: 'TEXT',
+}
+
+
+def column_type(field: ModelField) -> [str]:
+    if field.shape == SHAPE_SINGLETON and field.type_ in SQL_TYPES:
+        return SQL_TYPES[field.type_]
+    return None
+
+
+def order_by(query: Query) -> str:
+    if query.sort_key is None:
+        return ' ORDER BY "id"'
+    return f' ORDER BY "{query.sort_key}"{" DESC" if query.desc else ""}, "id"'
+
+
+def aggregate_sql(aggregate: Aggregate) -> str:
+    if aggregate.func == 'count':
+        return 'COUNT(*)'
+    if aggregate.func == 'sum':
+        return f'COALESCE(SUM("{aggregate.key}"), 0)'
+    return f'{aggregate.func.upper()}("{aggregate.key}")'
+
+
+def encode_json(value) -> str:
+    return json.dumps(value, default=pydantic_encoder)
+
+
+def keyset(query: Query, after: BaseModel, json_fields=()) -> tuple[str, list]:
+    key = f'"{query.sort_key}"'
+    value = getattr(after, query.sort_key)
+    if query.sort_key in json_fields:
+        value = encode_json(value)
+    if query.desc:
+        if value is None:
+            return f'{key} IS NULL AND "id" > ?', [after.id]
+        return f'({key} < ? OR {key} IS NULL OR ({key} = ? AND "id" > ?))', [value, value, after.id]
+    if value is None:
+        return f'({key} IS NOT NULL OR "id" > ?)', [after.id]
+    return f'({key} > ? OR ({key} = ? AND "id" > ?))', [value, value, after.id]
+
+
+COMPARISONS = {
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+}
+
+
+def predicate(key: str, op: str, args: tuple) -> tuple[str, list]:
+    column = f'"{key}"'
+    if op == 'eq':
+        return f'{column} IS ?', [args[0]]
+    if op == 'between':
+        return f'{column} BETWEEN ? AND ?', list(args)
+    if op in COMPARISONS:
+        return f'{column} {COMPARISONS[op]} ?', [args[0]]
+    values = [i for i in args[0] if i is not None]
+    clauses = [f'{column} IN ({", ".join("?" * len(values))})'] if values else []
+    if len(values) < len(args[0]):
+        clauses.append(f'{column} IS NULL')
+    return f'({" OR ".join(clauses) or "0"})', values
+
+
+def where(query: Query, values: tuple = (), json_fields=()) -> tuple[list, list]:
+    clauses = []
+    params = []
+    for key, op, args in query.split(values):
+        if key in json_fields:
+            args = ([encode_json(i) for i in args[0]],) if op == 'in' else tuple(encode_json(i) for i in args)
+        clause, args = predicate(key, op, args)
+        clauses.append(clause)
+        params.extend(args)
+    return clauses, params
+
+
+def statement(select: str, query: Query, values: tuple = (), window: [Window] = None,
+              json_fields=()) -> tuple[str, list]:
+    clauses, params = where(query, values, json_fields)
+    if window is not None and window.after is not None:
+        clause, args = keyset(query, window.after, json_fields)
+        clauses.append(clause)
+        params.extend(args)
+    if clauses:
+        select += ' WHERE ' + ' AND '.join(clauses)
+    select += order_by(query)
+    if window is not None:
+        select += ' LIMIT ? OFFSET ?'
+        params += [-1 if window.limit is None else window.limit, window.offset]
+    return select, params
+
+
+class Sqlite(Repository):
+    _model = BaseModel
+    _index_keys = ()
+    _sort_keys = ()
+
+    _self_add = ['_create', '_dump', '_parse_row', '_parse', '_insert', '_delete', 'close']
+
+    def __init__(self, path, check_same_thread: bool = True):
+        self._path = path
+        self._table = self._model.__name__.lower()
+        self._fields = list(self._model.__fields__)
+        self._json_fields = {k for k, v in self._model.__fields__.items() if column_type(v) is None}
+        self._columns = ', '.join(f'"{i}"' for i in self._fields)
+        self._select = f'SELECT {self._columns} FROM "{self._table}"'
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=check_same_thread)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._create()
+
+    def _create(self):
+        columns = []
+        for name, field in self._model.__fields__.items():
+            if name == 'id':
+                columns.append('"id" INTEGER PRIMARY KEY AUTOINCREMENT')
+            else:
+                columns.append(f'"{name}" {column_type(field) or "TEXT"}')
+        with self._connection:
+            self._connection.execute(f'CREATE TABLE IF NOT EXISTS "{self._table}" ({", ".join(columns)})')
+            for key in dict.fromkeys(self._index_keys + self._sort_keys):
+                if key != 'id':
+                    self._connection.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{self._table}_{key}" ON "{self._table}" ("{key}")'
+                    )
+        self._next_id = f'SELECT COALESCE(MAX("id"), 0) + 1 FROM "{self._table}"'
+        if self._connection.execute('SELECT 1 FROM sqlite_master WHERE name = \'sqlite_sequence\'').fetchone():
+            self._next_id = (
+                f'SELECT MAX(COALESCE(MAX("id"), 0), '
+                f'COALESCE((SELECT "seq" FROM sqlite_sequence WHERE "name" = \'{self._table}\'), 0)) + 1 '
+                f'FROM "{self._table}"'
+            )
+
+    def _dump(self, model) -> tuple:
+        data = model.dict()
+        for i in self._json_fields:
+            data[i] = encode_json(data[i])
+        return tuple(data[i] for i in self._fields)
+
+    def _parse_row(self, row) -> BaseModel:
+        data = dict(zip(self._fields, row))
+        for i in self._json_fields:
+            data[i] = json.loads(data[i])
+        return self._model.parse_obj(data)
+
+    def _parse(self, rows, lazy: bool = False):
+        models = map(self._parse_row, rows)
+        return models if lazy else list(models)
+
+    def _insert(self, models: list):
+        with self._connection:
+            self._connection.execute('BEGIN IMMEDIATE')
+            _id, = self._connection.execute(self._next_id).fetchone()
+            for i in models:
+                if i.id is None:
+                    i.id = _id
+                _id = max(_id, i.id + 1)
+            self._connection.executemany(
+                f'INSERT OR REPLACE INTO "{self._table}" ({self._columns}) '
+                f'VALUES ({", ".join("?" * len(self._fields))})',
+                [self._dump(i) for i in models]
+            )
+        return models
+
+    def _delete(self, models: list):
+        with self._connection:
+            self._connection.execute('BEGIN IMMEDIATE')
+            for i in models:
+                cursor = self._connection.execute(f'DELETE FROM "{self._table}" WHERE "id" = ?', (i.id,))
+                if cursor.rowcount == 0:
+                    raise KeyError(i.id)
+        return models
+
+    def close(self):
+        self._connection.close()
+
+    def find(self, _id):
+        models = self._parse(self._connection.execute(f'{self._select} WHERE "id" = ?', (_id,)))
+        return models[0] if models else None
+
+    def save(self, model):
+        return self._insert([model])[0]
+
+    def save_all(self, models):
+        return self._insert(list(models))
+
+    def _find_all(self, query: Query, window: [Window] = None):
+        return self._parse(
+            self._connection.execute(*statement(self._select, query, (), window, self._json_fields)), query.lazy
+        )
+
+    def find_all(self, sort_key: [str] = None, desc: bool = False) -> list[BaseModel]:
+        return self._find_all(compile_query(self._model, sort_key=sort_key, desc=desc))
+
+    def _find_by(self, query: Query, values: tuple, window: [Window] = None):
+        return self._parse(
+            self._connection.execute(*statement(self._select, query, values, window, self._json_fields)), query.lazy
+        )
+
+    def find_by(self, key: str, value, sort_key: [str] = None, desc: [bool] = None) -> list[BaseModel]:
+        return self._find_by(compile_query(self._model, key, sort_key, bool(desc)), (value,))
+
+    def count_all(self) -> int:
+        return self._connection.execute(f'SELECT COUNT(*) FROM "{self._table}"').fetchone()[0]
+
+    def _count_by(self, query: Query, values: tuple) -> int:
+        clauses, params = where(query, values, self._json_fields)
+        return self._connection.execute(
+            f'SELECT COUNT(*) FROM "{self._table}" WHERE {" AND ".join(clauses)}', params
+        ).fetchone()[0]
+
+    def _exists_by(self, query: Query, values: tuple) -> bool:
+        clauses, params = where(query, values, self._json_fields)
+        return bool(self._connection.execute(
+            f'SELECT EXISTS (SELECT 1 FROM "{self._table}" WHERE {" AND ".join(clauses)})', params
+        ).fetchone()[0])
+
+    def _aggregate(self, aggregate: Aggregate):
+        select = aggregate_sql(aggregate)
+        if aggregate.by_key is None:
+            return aggregate.cast(self._connection.execute(f'SELECT {select} FROM "{self._table}"').fetchone()[0])
+        key = f'"{aggregate.by_key}"'
+        rows = self._connection.execute(f'SELECT {key}, {select} FROM "{self._table}" GROUP BY {key} ORDER BY {key}')
+        return {None if k is None else aggregate.by_type(k): aggregate.cast(v) for k, v in rows}
+
+    def remove(self, model):
+        return self._delete([model])[0]
+
+    def remove_all(self, models):
+        return self._delete(list(models))
+
+    def _remove_by(self, query: Query, values: tuple) -> list[BaseModel]:
+        clauses, params = where(query, values, self._json_fields)
+        condition = ' AND '.join(clauses)
+        with self._connection:
+            self._connection.execute('BEGIN IMMEDIATE')
+            models = self._parse(self._connection.execute(
+                f'{self._select} WHERE {condition} ORDER BY "id"', params
+            ))
+            self._connection.execute(f'DELETE FROM "{self._table}" WHERE {condition}', params)
+        return models
+
+    def remove_by(self, key: str, value) -> list[BaseModel]:
+        return self._remove_by(compile_query(self._model, key), (value,))
+
+
+@lru_cache(maxsize=None)
+def sqlite_class(model: type[BaseModel], index_keys: tuple, sort_keys: tuple) -> type:
+    return type(Sqlite.__name__, (Sqlite,), {'_model': model, '_index_keys': index_keys, '_sort_keys': sort_keys})
+
+
+def check_ranges(abc_class: type, repository: type) -> type:
+    fields = repository._model.__fields__
+    for k in abc_class.__dict__:
+        if not k.startswith(('find_by', 'count_by', 'exists_by', 'remove_by')):
+            continue
+        for key, op in parse_query(repository._model, k).predicates:
+            if op in RANGES and column_type(fields[key]) is None:
+                raise ValueError(f'{k}: sqlite stores {key!r} as JSON text and cannot compare it with {op!r}')
+    return repository
+
+
+def abc2db_sqlite(abc_class: type) -> type:
+    return check_ranges(abc_class, build_repository_impl(abc_class, Sqlite))
@@ -0,0 +1,59 @@
+import threading
+import time
+from abc import ABC
+
+from pydantic import BaseModel
+
+from abc2db import abc2db_memory
+
+
+class User(BaseModel):
+    id: int | None
+    name: str
+    group: int
+
+
+class UserRepository(ABC):
+    def find(self, _id) -> User:
+        ...
+
+    def save(self, user: User) -> User:
+        ...
+
+    def find_by_group(self, group: int) -> list[User]:
+        ...
+
+    def count_all(self) -> int:
+        ...
+
+
+UserRepositoryMemory = abc2db_memory(UserRepository)
+repo: UserRepository = UserRepositoryMemory(thread_safe=True)
+for i in range(10000):
+    repo.save(User(name=f'user{i}', group=i % 100))
+
+
+def run(threads: int, target, n: int) -> float:
+    workers = [threading.Thread(target=target, args=(n,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for i in workers:
+        i.start()
+    for i in workers:
+        i.join()
+    return threads * n / (time.perf_counter() - start)
+
+
+def read(n: int):
+    for i in range(n):
+        repo.find_by_group(i % 100)
+
+
+def write(n: int):
+    for i in range(n):
+        repo.save(User(name='user', group=i % 100))
+
+
+for threads in (1, 4, 8):
+    print(f'{threads} threads: {run(threads, read, 2000):.0f} reads/s, {run(threads, write, 2000):.0f} writes/s')
+ids = [i.id for g in range(100) for i in repo.find_by_group(g)]
+assert len(ids) == len(set(ids)) == repo.count_all()
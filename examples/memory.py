@@ -18,7 +18,7 @@ class UserRepository(ABC):
     def save(self, user: User) -> User:
         ...
 
-    def find_by_id_sort_by_r_desc(self) -> list[User]:
+    def find_all_sort_by_name_desc(self) -> list[User]:
         ...
 
 
@@ -0,0 +1,49 @@
+import os
+import time
+from abc import ABC
+
+from pydantic import BaseModel
+
+from abc2db import abc2db_memory
+
+
+class User(BaseModel):
+    id: int | None
+    name: str
+    group: int
+
+
+class UserRepository(ABC):
+    def find(self, _id) -> User:
+        ...
+
+    def save(self, user: User) -> User:
+        ...
+
+    def save_all(self, users: list[User]) -> list[User]:
+        ...
+
+    def find_by_group(self, group: int) -> list[User]:
+        ...
+
+
+UserRepositoryMemory = abc2db_memory(UserRepository)
+rows = [{'name': f'user{i}', 'group': i % 100} for i in range(200000)]
+
+start = time.perf_counter()
+repo: UserRepository = UserRepositoryMemory(snapshot='users.snapshot', snapshot_codec='msgpack')
+repo.save_all(User(**i) for i in rows)
+print(f'save_all: {time.perf_counter() - start:.3f}s')
+
+start = time.perf_counter()
+repo.snapshot()
+print(f'snapshot: {time.perf_counter() - start:.3f}s, {os.path.getsize("users.snapshot") >> 10} KiB')
+
+start = time.perf_counter()
+restored: UserRepository = UserRepositoryMemory(snapshot='users.snapshot', snapshot_codec='msgpack')
+print(f'restore: {time.perf_counter() - start:.3f}s')
+
+start = time.perf_counter()
+assert len(restored.find_by_group(7)) == 2000
+print(f'first query: {time.perf_counter() - start:.3f}s')
+os.remove('users.snapshot')
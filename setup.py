@@ -16,5 +16,10 @@ setup(
     ],
     install_requires=[
         'pydantic>=1.10.4',
-    ]
+    ],
+    extras_require={
+        'numpy': ['numpy'],
+        'orjson': ['orjson'],
+        'msgpack': ['msgpack'],
+    }
 )
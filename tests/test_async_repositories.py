@@ -1,10 +1,15 @@
+import asyncio
 import os
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from abc import ABC, abstractmethod
 
 from pydantic import BaseModel
 
-from abc2db import abc2db_async_memory, abc2db_async_json
+from abc2db import abc2db_async_memory, abc2db_async_json, abc2db_async_sqlite, abc2db_cached
+from abc2db.json import write_atomic
+from abc2db.query import Query
 
 
 class User(BaseModel):
@@ -58,10 +63,98 @@ class UserRepository(ABC):
     async def find_by_ref_id_sort_by_id_desc(self, ref_id: int) -> list[User]:
         ...
 
+    @abstractmethod
+    async def find_all_sort_by_id_limit_2(self, offset: int = 0) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def find_by_ref_id_sort_by_id_desc_limit(self, ref_id: int, limit: int, offset: int = 0) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def find_all_sort_by_ref_id_page(self, limit: int, after: User = None) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def find_all_sort_by_ref_id_desc_page_2(self, after: User = None) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def find_all_iter(self):
+        ...
+
+    @abstractmethod
+    async def find_all_sort_by_ref_id_limit_iter(self, limit: int, offset: int = 0):
+        ...
+
     @abstractmethod
     async def remove(self, model: User) -> None:
         ...
 
+    @abstractmethod
+    async def remove_all(self, models: [User]) -> [User]:
+        ...
+
+    @abstractmethod
+    async def remove_by_ref_id(self, ref_id: int) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def find_by_ref_id_and_name(self, ref_id: int, name: str) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def find_by_ref_id_gt_sort_by_ref_id(self, ref_id: int) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def find_by_ref_id_between_and_name_in(self, start: int, end: int, names: list[str]) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def find_by_ref_id_in(self, ref_ids: list[int]) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def remove_by_ref_id_lte(self, ref_id: int) -> list[User]:
+        ...
+
+    @abstractmethod
+    async def count_all(self) -> int:
+        ...
+
+    @abstractmethod
+    async def count_by_ref_id(self, ref_id: int) -> int:
+        ...
+
+    @abstractmethod
+    async def count_by_ref_id_gte_and_name(self, ref_id: int, name: str) -> int:
+        ...
+
+    @abstractmethod
+    async def exists_by_name(self, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def sum_ref_id(self) -> int:
+        ...
+
+    @abstractmethod
+    async def avg_ref_id(self) -> float:
+        ...
+
+    @abstractmethod
+    async def max_id_by_ref_id(self) -> dict:
+        ...
+
+    @abstractmethod
+    async def min_ref_id_by_name(self) -> dict:
+        ...
+
+    @abstractmethod
+    async def group_count_by_ref_id(self) -> dict:
+        ...
+
 
 class TestRepositoryMemory(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self) -> None:
@@ -69,15 +162,28 @@ class TestRepositoryMemory(unittest.IsolatedAsyncioTestCase):
         with open('users.json', 'w') as file:
             file.write('{}')
         UserRepositoryJson = abc2db_async_json(UserRepository)
+        if os.path.exists('users_async.db'):
+            os.remove('users_async.db')
+        UserRepositorySqlite = abc2db_async_sqlite(UserRepository)
 
         self.repositories: list[UserRepository] = [
             UserRepositoryMemory(),
-            UserRepositoryJson('users.json')
+            UserRepositoryJson('users.json'),
+            UserRepositorySqlite('users_async.db'),
+            UserRepositoryMemory(compact=True)
         ]
 
+    async def asyncTearDown(self) -> None:
+        await self.repositories[2].close()
+
     @classmethod
     def tearDownClass(cls) -> None:
-        os.remove('users.json')
+        for path in ('users.json', 'users.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+        for path in ('users_async.db', 'users_async.db-wal', 'users_async.db-shm'):
+            if os.path.exists(path):
+                os.remove(path)
 
     async def test_build(self):
         for repo in self.repositories:
@@ -160,3 +266,392 @@ class TestRepositoryMemory(unittest.IsolatedAsyncioTestCase):
                 self.assertEqual(await repo.find(user1.id), user1)
                 await repo.remove(user1)
                 self.assertIsNone(await repo.find(user1.id))
+
+    async def test_find_by_changed(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all([user1, user2])
+                user1.ref_id = 2
+                await repo.save(user1)
+                self.assertEqual(await repo.find_by_ref_id(1), [user2])
+                self.assertEqual(await repo.find_by_ref_id(2), [user1])
+                await repo.remove(user2)
+                self.assertEqual(await repo.find_by_ref_id(1), [])
+                user1.ref_id = 1
+
+    async def test_find_by_order(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                a, b, c = await repo.save_all([
+                    User(name='a', ref_id=1), User(name='b', ref_id=2), User(name='c', ref_id=1)
+                ])
+                b.ref_id = 1
+                await repo.save(b)
+                self.assertEqual(await repo.find_by_ref_id(1), [a, b, c])
+                await repo.remove_all([a, b, c])
+
+    async def test_get_all_sort_none(self):
+        user1 = User(name='user1', ref_id=2)
+        user2 = User(name='user2')
+        user3 = User(name='user3', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all([user1, user2, user3])
+                self.assertEqual(await repo.find_all_sort_by_ref_id(), [user2, user3, user1])
+                self.assertEqual(await repo.find_all_sort_by_ref_id_desc(), [user1, user3, user2])
+                user3.ref_id = 3
+                await repo.save(user3)
+                self.assertEqual(await repo.find_all_sort_by_ref_id(), [user2, user1, user3])
+                user3.ref_id = 1
+
+    async def test_remove_all(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=1)
+        user3 = User(name='user3', ref_id=2)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all([user1, user2, user3])
+                await repo.remove_all([user1, user3])
+                self.assertEqual(await repo.find_all(), [user2])
+
+    async def test_remove_all_missing(self):
+        user1 = User(name='user1')
+        user2 = User(name='user2')
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all([user1, user2])
+                with self.assertRaises(KeyError):
+                    await repo.remove_all([user1, User(id=10, name='user10')])
+                self.assertEqual(await repo.find_all(), [user1, user2])
+
+    async def test_remove_by(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=1)
+        user3 = User(name='user3', ref_id=2)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all([user1, user2, user3])
+                self.assertEqual(await repo.remove_by_ref_id(1), [user1, user2])
+                self.assertEqual(await repo.find_all(), [user3])
+                self.assertEqual(await repo.find_by_ref_id(1), [])
+                self.assertEqual(await repo.remove_by_ref_id(1), [])
+
+    async def test_save_all_ids(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save(User(id=5, name='user1'))
+                users = await repo.save_all([User(name='user2'), User(id=2, name='user3'), User(name='user4')])
+                self.assertEqual([i.id for i in users], [6, 2, 7])
+
+    async def test_paging(self):
+        user1 = User(name='user1', ref_id=2)
+        user2 = User(name='user2')
+        user3 = User(name='user3', ref_id=1)
+        user4 = User(name='user4', ref_id=2)
+        user5 = User(name='user5')
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all([user1, user2, user3, user4, user5])
+                self.assertEqual(await repo.find_all_sort_by_id_limit_2(), [user1, user2])
+                self.assertEqual(await repo.find_all_sort_by_id_limit_2(2), [user3, user4])
+                self.assertEqual(await repo.find_by_ref_id_sort_by_id_desc_limit(2, 1), [user4])
+                self.assertEqual(await repo.find_by_ref_id_sort_by_id_desc_limit(2, 1, 1), [user1])
+                self.assertEqual(await repo.find_all_sort_by_ref_id_page(2), [user2, user5])
+                self.assertEqual(await repo.find_all_sort_by_ref_id_page(2, user5), [user3, user1])
+                self.assertEqual(await repo.find_all_sort_by_ref_id_page(2, user1), [user4])
+                self.assertEqual(await repo.find_all_sort_by_ref_id_desc_page_2(), [user1, user4])
+                self.assertEqual(await repo.find_all_sort_by_ref_id_desc_page_2(user4), [user3, user2])
+                self.assertEqual(await repo.find_all_sort_by_ref_id_desc_page_2(user2), [user5])
+
+    async def test_keyword_arguments(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=2)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all([user1, user2])
+                self.assertEqual(await repo.find_by_ref_id(ref_id=1), [user1])
+                self.assertEqual(await repo.find_all_sort_by_id_limit_2(offset=1), [user2])
+                with self.assertRaises(TypeError):
+                    await repo.find_by_ref_id()
+
+    async def test_iter(self):
+        users = [User(name=f'user{i}', ref_id=i % 2) for i in range(5)]
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all(users)
+                with mock.patch.object(Query, 'batch', 2):
+                    self.assertEqual([i async for i in repo.find_all_iter()], users)
+                    self.assertEqual([i async for i in repo.find_all_sort_by_ref_id_limit_iter(4, 1)],
+                                     [users[2], users[4], users[1], users[3]])
+
+    async def test_predicates(self):
+        user1 = User(name='user1', ref_id=3)
+        user2 = User(name='user2')
+        user3 = User(name='user3', ref_id=1)
+        user4 = User(name='user4', ref_id=2)
+        user5 = User(name='user1', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                await repo.save_all([user1, user2, user3, user4, user5])
+                self.assertEqual(await repo.find_by_ref_id_and_name(1, 'user1'), [user5])
+                self.assertEqual(await repo.find_by_ref_id_gt_sort_by_ref_id(1), [user4, user1])
+                self.assertEqual(await repo.find_by_ref_id_between_and_name_in(1, 2, ['user1', 'user4']),
+                                 [user4, user5])
+                self.assertEqual(await repo.find_by_ref_id_in([2, None]), [user2, user4])
+                self.assertEqual(await repo.find_by_ref_id_in([]), [])
+                self.assertEqual(await repo.remove_by_ref_id_lte(2), [user3, user4, user5])
+                self.assertEqual(await repo.find_all(), [user1, user2])
+
+    async def test_count(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=2)
+        user3 = User(name='user3', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                self.assertEqual(await repo.count_all(), 0)
+                self.assertFalse(await repo.exists_by_name('user1'))
+                await repo.save_all([user1, user2, user3])
+                self.assertEqual(await repo.count_all(), 3)
+                self.assertEqual(await repo.count_by_ref_id(1), 2)
+                self.assertEqual(await repo.count_by_ref_id(3), 0)
+                self.assertEqual(await repo.count_by_ref_id_gte_and_name(1, 'user2'), 1)
+                self.assertTrue(await repo.exists_by_name('user1'))
+                self.assertFalse(await repo.exists_by_name('user4'))
+
+    async def test_aggregate(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                users = [
+                    User(name='user1', ref_id=1),
+                    User(name='user2'),
+                    User(name='user1', ref_id=3),
+                    User(name='user3', ref_id=1),
+                ]
+                self.assertEqual(await repo.sum_ref_id(), 0)
+                self.assertIsNone(await repo.avg_ref_id())
+                self.assertEqual(await repo.group_count_by_ref_id(), {})
+                await repo.save_all(users)
+                self.assertEqual(await repo.sum_ref_id(), 5)
+                self.assertEqual(await repo.avg_ref_id(), 5 / 3)
+                self.assertEqual(await repo.max_id_by_ref_id(), {None: 2, 1: 4, 3: 3})
+                self.assertEqual(await repo.min_ref_id_by_name(), {'user1': 1, 'user2': None, 'user3': 1})
+                self.assertEqual(await repo.group_count_by_ref_id(), {None: 1, 1: 2, 3: 1})
+                users[0].ref_id = 5
+                await repo.save(users[0])
+                await repo.remove(users[1])
+                await repo.save(User(name='user4', ref_id=5))
+                self.assertEqual(await repo.sum_ref_id(), 14)
+                self.assertEqual(await repo.max_id_by_ref_id(), {1: 4, 3: 3, 5: 5})
+                self.assertEqual(await repo.group_count_by_ref_id(), {1: 1, 3: 1, 5: 2})
+
+
+class TestAsyncTransaction(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        with open('users_transaction.json', 'w') as file:
+            file.write('{}')
+        self.repositories = [
+            abc2db_async_memory(UserRepository)(),
+            abc2db_async_json(UserRepository)('users_transaction.json'),
+            abc2db_async_json(UserRepository)('users_transaction.json', group_commit=True)
+        ]
+
+    async def asyncTearDown(self) -> None:
+        for path in ('users_transaction.json', 'users_transaction.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def test_commit(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                async with repo.transaction():
+                    parent = await repo.save(User(name='parent'))
+                    await repo.save_all([User(name=f'child{i}', ref_id=parent.id) for i in range(3)])
+                    self.assertEqual(len(await repo.find_by_ref_id(parent.id)), 3)
+                self.assertEqual(len(await repo.find_by_ref_id(parent.id)), 3)
+                await repo.remove_all(await repo.find_all())
+
+    async def test_rollback(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                user1 = await repo.save(User(name='user1', ref_id=1))
+                with self.assertRaises(RuntimeError):
+                    async with repo.transaction():
+                        await repo.save(User(name='user2', ref_id=1))
+                        await repo.remove_by_ref_id(1)
+                        self.assertEqual(await repo.find_all(), [])
+                        raise RuntimeError
+                self.assertEqual(await repo.find_all(), [user1])
+                await repo.remove(user1)
+
+    async def test_rollback_update(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                user1 = await repo.save(User(name='user1', ref_id=1))
+                with self.assertRaises(RuntimeError):
+                    async with repo.transaction():
+                        user = await repo.find(user1.id)
+                        user.name = 'changed'
+                        user.ref_id = 2
+                        await repo.save(user)
+                        await repo.save(User(name='user2'))
+                        raise RuntimeError
+                self.assertEqual((await repo.find(user1.id)).name, 'user1')
+                self.assertEqual([i.id for i in await repo.find_by_ref_id(1)], [user1.id])
+                self.assertEqual((await repo.save(User(name='user3'))).id, user1.id + 1)
+                await repo.remove_all(await repo.find_all())
+
+    async def test_isolation(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                entered = asyncio.Event()
+
+                async def outside():
+                    await entered.wait()
+                    return await repo.save(User(name='outside'))
+
+                task = asyncio.create_task(outside())
+                with self.assertRaises(RuntimeError):
+                    async with repo.transaction():
+                        await repo.save(User(name='inside'))
+                        entered.set()
+                        await asyncio.sleep(0.01)
+                        self.assertFalse(task.done())
+                        raise RuntimeError
+                user = await task
+                self.assertEqual(await repo.find_all(), [user])
+                await repo.remove(user)
+
+
+class TestAsyncSnapshot(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self) -> None:
+        for path in ('users_async.snapshot', 'users_async.snapshot.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def test_restore(self):
+        UserRepositoryMemory = abc2db_async_memory(UserRepository)
+        repo = UserRepositoryMemory(snapshot='users_async.snapshot')
+        users = await repo.save_all([User(name=f'user{i}', ref_id=i % 2) for i in range(6)])
+        await (await repo.snapshot(background=True))
+        await repo.save(User(name='unsaved'))
+
+        restored = UserRepositoryMemory(snapshot='users_async.snapshot')
+        self.assertEqual(await restored.find_all(), users)
+        self.assertEqual(await restored.find_by_ref_id(1), users[1::2])
+        self.assertEqual((await restored.save(User(name='new'))).id, 7)
+        await restored.close()
+        self.assertEqual(len(await UserRepositoryMemory(snapshot='users_async.snapshot').find_all()), 7)
+
+
+class TestAsyncCached(unittest.IsolatedAsyncioTestCase):
+    async def test_cached(self):
+        repo = abc2db_cached(UserRepository, abc2db_async_memory)()
+        user1, user2 = await repo.save_all([User(name='user1', ref_id=1), User(name='user2', ref_id=2)])
+        self.assertEqual(await repo.find_by_ref_id(1), [user1])
+        self.assertEqual(await repo.find_by_ref_id(1), [user1])
+        self.assertEqual(await repo.find(2), user2)
+        self.assertEqual((repo.cache.hits, repo.cache.misses), (1, 2))
+        user2.ref_id = 1
+        await repo.save(user2)
+        self.assertEqual(await repo.find_by_ref_id(1), [user1, user2])
+        self.assertEqual([i async for i in repo.find_all_iter()], [user1, user2])
+
+
+class TestAsyncJsonExecutor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        with open('users_executor.json', 'w') as file:
+            file.write('{}')
+        self.UserRepositoryJson = abc2db_async_json(UserRepository)
+
+    async def asyncTearDown(self) -> None:
+        for path in ('users_executor.json', 'users_executor.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def test_shared_json_class(self):
+        first = self.UserRepositoryJson('users_executor.json')
+        second = self.UserRepositoryJson('users_executor.json')
+        self.assertIs(type(first._json), type(second._json))
+
+    async def test_concurrent_save(self):
+        with ThreadPoolExecutor(4) as executor:
+            repo = self.UserRepositoryJson('users_executor.json', executor=executor)
+            users = await asyncio.gather(*[repo.save(User(name=f'user{i}')) for i in range(50)])
+        self.assertEqual(len({i.id for i in users}), 50)
+        other = self.UserRepositoryJson('users_executor.json', strict=True)
+        self.assertEqual(len(await other.find_all()), 50)
+
+    async def test_cancel(self):
+        repo = self.UserRepositoryJson('users_executor.json')
+        task = asyncio.create_task(repo.save_all([User(name=f'user{i}') for i in range(100)]))
+        await asyncio.sleep(0)
+        task.cancel()
+        await repo.save(User(name='user100'))
+        self.assertEqual(len(await repo.find_all()), 101)
+
+    async def test_group_commit(self):
+        repo = self.UserRepositoryJson('users_executor.json', group_commit=True, commit_batch=32)
+        with mock.patch.object(repo._json, '_save', wraps=repo._json._save) as save:
+            users = await asyncio.gather(*[repo.save(User(name=f'user{i}')) for i in range(100)])
+        self.assertLess(save.call_count, 100)
+        self.assertEqual(len({i.id for i in users}), 100)
+        other = self.UserRepositoryJson('users_executor.json', strict=True)
+        self.assertEqual(await other.find_all(), users)
+
+    async def test_group_commit_durable(self):
+        repo = self.UserRepositoryJson('users_executor.json', group_commit=True)
+        with mock.patch('abc2db.json.write_atomic', wraps=write_atomic) as write:
+            await repo.save(User(name='user1'))
+        write.assert_called_once()
+        self.assertEqual(write.call_args.args[0], 'users_executor.json')
+
+    async def test_group_commit_error(self):
+        repo = self.UserRepositoryJson('users_executor.json', group_commit=True)
+        user1 = await repo.save(User(name='user1'))
+        results = await asyncio.gather(
+            repo.remove(User(id=10, name='user10')),
+            repo.save(User(name='user2')),
+            repo.remove(user1),
+            return_exceptions=True
+        )
+        self.assertIsInstance(results[0], KeyError)
+        self.assertEqual(await repo.find_all(), [results[1]])
+
+    async def test_group_commit_partial(self):
+        repo = self.UserRepositoryJson('users_executor.json', group_commit=True)
+        user1, user2 = await repo.save_all([User(name='user1'), User(name='user2')])
+        results = await asyncio.gather(
+            repo.remove_all([user1, User(id=10, name='user10')]),
+            repo.save(User(name='user3')),
+            return_exceptions=True
+        )
+        self.assertIsInstance(results[0], KeyError)
+        other = self.UserRepositoryJson('users_executor.json', strict=True)
+        self.assertEqual(await other.find_all(), [user1, user2, results[1]])
+
+
+class TestAsyncSqlitePool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.UserRepositorySqlite = abc2db_async_sqlite(UserRepository)
+        self.repo = self.UserRepositorySqlite('users_pool.db', readers=2)
+
+    async def asyncTearDown(self) -> None:
+        await self.repo.close()
+        for path in ('users_pool.db', 'users_pool.db-wal', 'users_pool.db-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def test_concurrent(self):
+        users = await asyncio.gather(*[self.repo.save(User(name=f'user{i}', ref_id=i % 3)) for i in range(30)])
+        self.assertEqual(len({i.id for i in users}), 30)
+        results = await asyncio.gather(*[self.repo.find_by_ref_id(i % 3) for i in range(12)])
+        self.assertEqual([len(i) for i in results], [10] * 12)
+
+    async def test_cancel(self):
+        task = asyncio.create_task(self.repo.save_all([User(name=f'user{i}') for i in range(100)]))
+        await asyncio.sleep(0)
+        task.cancel()
+        await self.repo.save(User(name='user100'))
+        self.assertEqual(len(await self.repo.find_all()), 101)
@@ -1,10 +1,22 @@
+import multiprocessing
 import os
+import shutil
+import threading
+import time
 import unittest
+from unittest import mock
 from abc import ABC, abstractmethod
+from datetime import datetime
 
 from pydantic import BaseModel
 
-from abc2db import abc2db_memory, abc2db_json
+from abc2db import abc2db_memory, abc2db_json, abc2db_sqlite, abc2db_sharded_json, abc2db_cached
+from abc2db import abc2db_mmap, build_mmap
+from abc2db import aggregate, codecs, snapshot
+from abc2db.json import Json
+from abc2db.mmap import write_mmap
+from abc2db.query import Query
+from abc2db.snapshot import MappedBase
 
 
 class User(BaseModel):
@@ -13,6 +25,47 @@ class User(BaseModel):
     ref_id: int | None = None
 
 
+class Address(BaseModel):
+    city: str
+
+
+class Event(BaseModel):
+    id: int | None
+    at: datetime
+    addr: Address
+    ref_id: int | None = None
+
+
+class EventRepository(ABC):
+    @abstractmethod
+    def find(self, _id) -> Event:
+        ...
+
+    @abstractmethod
+    def save(self, event: Event) -> Event:
+        ...
+
+    @abstractmethod
+    def find_all_sort_by_at(self) -> list[Event]:
+        ...
+
+    @abstractmethod
+    def find_by_ref_id(self, ref_id: int) -> list[Event]:
+        ...
+
+    @abstractmethod
+    def find_by_at(self, at: datetime) -> list[Event]:
+        ...
+
+    @abstractmethod
+    def count_by_at(self, at: datetime) -> int:
+        ...
+
+    @abstractmethod
+    def find_by_addr_in(self, addrs: list[Address]) -> list[Event]:
+        ...
+
+
 class UserRepository(ABC):
     @abstractmethod
     def find(self, _id) -> User:
@@ -58,10 +111,104 @@ class UserRepository(ABC):
     def find_by_ref_id_sort_by_id_desc(self, ref_id: int) -> list[User]:
         ...
 
+    @abstractmethod
+    def find_all_sort_by_id_limit_2(self, offset: int = 0) -> list[User]:
+        ...
+
+    @abstractmethod
+    def find_by_ref_id_sort_by_id_desc_limit(self, ref_id: int, limit: int, offset: int = 0) -> list[User]:
+        ...
+
+    @abstractmethod
+    def find_all_sort_by_ref_id_page(self, limit: int, after: User = None) -> list[User]:
+        ...
+
+    @abstractmethod
+    def find_all_sort_by_ref_id_desc_page_2(self, after: User = None) -> list[User]:
+        ...
+
+    @abstractmethod
+    def find_all_iter(self):
+        ...
+
+    @abstractmethod
+    def find_all_sort_by_ref_id_limit_iter(self, limit: int, offset: int = 0):
+        ...
+
     @abstractmethod
     def remove(self, model: User) -> None:
         ...
 
+    @abstractmethod
+    def remove_all(self, models: [User]) -> [User]:
+        ...
+
+    @abstractmethod
+    def remove_by_ref_id(self, ref_id: int) -> list[User]:
+        ...
+
+    @abstractmethod
+    def find_by_ref_id_and_name(self, ref_id: int, name: str) -> list[User]:
+        ...
+
+    @abstractmethod
+    def find_by_ref_id_gt_sort_by_ref_id(self, ref_id: int) -> list[User]:
+        ...
+
+    @abstractmethod
+    def find_by_ref_id_between_and_name_in(self, start: int, end: int, names: list[str]) -> list[User]:
+        ...
+
+    @abstractmethod
+    def find_by_ref_id_in(self, ref_ids: list[int]) -> list[User]:
+        ...
+
+    @abstractmethod
+    def remove_by_ref_id_lte(self, ref_id: int) -> list[User]:
+        ...
+
+    @abstractmethod
+    def count_all(self) -> int:
+        ...
+
+    @abstractmethod
+    def count_by_ref_id(self, ref_id: int) -> int:
+        ...
+
+    @abstractmethod
+    def count_by_ref_id_gte_and_name(self, ref_id: int, name: str) -> int:
+        ...
+
+    @abstractmethod
+    def exists_by_name(self, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def sum_ref_id(self) -> int:
+        ...
+
+    @abstractmethod
+    def avg_ref_id(self) -> float:
+        ...
+
+    @abstractmethod
+    def max_id_by_ref_id(self) -> dict:
+        ...
+
+    @abstractmethod
+    def min_ref_id_by_name(self) -> dict:
+        ...
+
+    @abstractmethod
+    def group_count_by_ref_id(self) -> dict:
+        ...
+
+
+def save_users(path: str, count: int):
+    repo = abc2db_json(UserRepository)(path, multiprocess=True)
+    for i in range(count):
+        repo.save(User(name=f'user{i}', ref_id=os.getpid()))
+
 
 class TestRepositoryMemory(unittest.TestCase):
     def setUp(self) -> None:
@@ -69,15 +216,34 @@ class TestRepositoryMemory(unittest.TestCase):
         with open('users.json', 'w') as file:
             file.write('{}')
         UserRepositoryJson = abc2db_json(UserRepository)
+        if os.path.exists('users.db'):
+            os.remove('users.db')
+        UserRepositorySqlite = abc2db_sqlite(UserRepository)
+        shutil.rmtree('users_sharded', ignore_errors=True)
+        UserRepositoryShardedJson = abc2db_sharded_json(UserRepository)
 
         self.repositories: list[UserRepository] = [
             UserRepositoryMemory(),
-            UserRepositoryJson('users.json')
+            UserRepositoryJson('users.json'),
+            UserRepositorySqlite('users.db'),
+            UserRepositoryMemory(compact=True),
+            UserRepositoryShardedJson('users_sharded', shards=3),
+            UserRepositoryMemory(thread_safe=True)
         ]
 
+    def tearDown(self) -> None:
+        self.repositories[2].close()
+        self.repositories[4].close()
+
     @classmethod
     def tearDownClass(cls) -> None:
-        os.remove('users.json')
+        for path in ('users.json', 'users.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree('users_sharded', ignore_errors=True)
+        for path in ('users.db', 'users.db-wal', 'users.db-shm'):
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_build(self):
         for repo in self.repositories:
@@ -160,3 +326,1101 @@ class TestRepositoryMemory(unittest.TestCase):
                 self.assertEqual(repo.find(user1.id), user1)
                 repo.remove(user1)
                 self.assertIsNone(repo.find(user1.id))
+
+    def test_find_by_changed(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all([user1, user2])
+                user1.ref_id = 2
+                repo.save(user1)
+                self.assertEqual(repo.find_by_ref_id(1), [user2])
+                self.assertEqual(repo.find_by_ref_id(2), [user1])
+                repo.remove(user2)
+                self.assertEqual(repo.find_by_ref_id(1), [])
+                user1.ref_id = 1
+
+    def test_find_by_order(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                a, b, c = repo.save_all([User(name='a', ref_id=1), User(name='b', ref_id=2), User(name='c', ref_id=1)])
+                b.ref_id = 1
+                repo.save(b)
+                self.assertEqual(repo.find_by_ref_id(1), [a, b, c])
+                repo.remove_all([a, b, c])
+
+    def test_get_all_sort_none(self):
+        user1 = User(name='user1', ref_id=2)
+        user2 = User(name='user2')
+        user3 = User(name='user3', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all([user1, user2, user3])
+                self.assertEqual(repo.find_all_sort_by_ref_id(), [user2, user3, user1])
+                self.assertEqual(repo.find_all_sort_by_ref_id_desc(), [user1, user3, user2])
+                user3.ref_id = 3
+                repo.save(user3)
+                self.assertEqual(repo.find_all_sort_by_ref_id(), [user2, user1, user3])
+                user3.ref_id = 1
+
+    def test_remove_all(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=1)
+        user3 = User(name='user3', ref_id=2)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all([user1, user2, user3])
+                repo.remove_all([user1, user3])
+                self.assertEqual(repo.find_all(), [user2])
+
+    def test_remove_all_missing(self):
+        user1 = User(name='user1')
+        user2 = User(name='user2')
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all([user1, user2])
+                with self.assertRaises(KeyError):
+                    repo.remove_all([user1, User(id=10, name='user10')])
+                self.assertEqual(repo.find_all(), [user1, user2])
+
+    def test_remove_by(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=1)
+        user3 = User(name='user3', ref_id=2)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all([user1, user2, user3])
+                self.assertEqual(repo.remove_by_ref_id(1), [user1, user2])
+                self.assertEqual(repo.find_all(), [user3])
+                self.assertEqual(repo.find_by_ref_id(1), [])
+                self.assertEqual(repo.remove_by_ref_id(1), [])
+
+    def test_save_all_ids(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save(User(id=5, name='user1'))
+                users = repo.save_all([User(name='user2'), User(id=2, name='user3'), User(name='user4')])
+                self.assertEqual([i.id for i in users], [6, 2, 7])
+
+    def test_paging(self):
+        user1 = User(name='user1', ref_id=2)
+        user2 = User(name='user2')
+        user3 = User(name='user3', ref_id=1)
+        user4 = User(name='user4', ref_id=2)
+        user5 = User(name='user5')
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all([user1, user2, user3, user4, user5])
+                self.assertEqual(repo.find_all_sort_by_id_limit_2(), [user1, user2])
+                self.assertEqual(repo.find_all_sort_by_id_limit_2(2), [user3, user4])
+                self.assertEqual(repo.find_by_ref_id_sort_by_id_desc_limit(2, 1), [user4])
+                self.assertEqual(repo.find_by_ref_id_sort_by_id_desc_limit(2, 1, 1), [user1])
+                self.assertEqual(repo.find_all_sort_by_ref_id_page(2), [user2, user5])
+                self.assertEqual(repo.find_all_sort_by_ref_id_page(2, user5), [user3, user1])
+                self.assertEqual(repo.find_all_sort_by_ref_id_page(2, user1), [user4])
+                self.assertEqual(repo.find_all_sort_by_ref_id_desc_page_2(), [user1, user4])
+                self.assertEqual(repo.find_all_sort_by_ref_id_desc_page_2(user4), [user3, user2])
+                self.assertEqual(repo.find_all_sort_by_ref_id_desc_page_2(user2), [user5])
+
+    def test_keyword_arguments(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=2)
+        user3 = User(name='user3', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all([user1, user2, user3])
+                self.assertEqual(repo.find_by_ref_id(ref_id=1), [user1, user3])
+                self.assertEqual(repo.find_all_sort_by_id_limit_2(offset=1), [user2, user3])
+                self.assertEqual(repo.find_all_sort_by_ref_id_page(1, after=user1), [user3])
+                self.assertEqual(repo.count_by_ref_id(ref_id=2), 1)
+                with self.assertRaises(TypeError):
+                    repo.find_by_ref_id()
+                with self.assertRaises(TypeError):
+                    repo.find_by_ref_id(1, 2)
+
+    def test_iter(self):
+        users = [User(name=f'user{i}', ref_id=i % 2) for i in range(5)]
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all(users)
+                with mock.patch.object(Query, 'batch', 2):
+                    self.assertEqual(list(repo.find_all_iter()), users)
+                    self.assertEqual(list(repo.find_all_sort_by_ref_id_limit_iter(4, 1)),
+                                     [users[2], users[4], users[1], users[3]])
+
+    def test_predicates(self):
+        user1 = User(name='user1', ref_id=3)
+        user2 = User(name='user2')
+        user3 = User(name='user3', ref_id=1)
+        user4 = User(name='user4', ref_id=2)
+        user5 = User(name='user1', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save_all([user1, user2, user3, user4, user5])
+                self.assertEqual(repo.find_by_ref_id_and_name(1, 'user1'), [user5])
+                self.assertEqual(repo.find_by_ref_id_gt_sort_by_ref_id(1), [user4, user1])
+                self.assertEqual(repo.find_by_ref_id_between_and_name_in(1, 2, ['user1', 'user4']), [user4, user5])
+                self.assertEqual(repo.find_by_ref_id_in([2, None]), [user2, user4])
+                self.assertEqual(repo.find_by_ref_id_in([]), [])
+                self.assertEqual(repo.remove_by_ref_id_lte(2), [user3, user4, user5])
+                self.assertEqual(repo.find_all(), [user1, user2])
+
+    def test_count(self):
+        user1 = User(name='user1', ref_id=1)
+        user2 = User(name='user2', ref_id=2)
+        user3 = User(name='user3', ref_id=1)
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                self.assertEqual(repo.count_all(), 0)
+                self.assertFalse(repo.exists_by_name('user1'))
+                repo.save_all([user1, user2, user3])
+                self.assertEqual(repo.count_all(), 3)
+                self.assertEqual(repo.count_by_ref_id(1), 2)
+                self.assertEqual(repo.count_by_ref_id(3), 0)
+                self.assertEqual(repo.count_by_ref_id_gte_and_name(1, 'user2'), 1)
+                self.assertTrue(repo.exists_by_name('user1'))
+                self.assertFalse(repo.exists_by_name('user4'))
+
+    def test_aggregate(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                users = [
+                    User(name='user1', ref_id=1),
+                    User(name='user2'),
+                    User(name='user1', ref_id=3),
+                    User(name='user3', ref_id=1),
+                ]
+                self.assertEqual(repo.sum_ref_id(), 0)
+                self.assertIsNone(repo.avg_ref_id())
+                self.assertEqual(repo.group_count_by_ref_id(), {})
+                repo.save_all(users)
+                self.assertEqual(repo.sum_ref_id(), 5)
+                self.assertEqual(repo.avg_ref_id(), 5 / 3)
+                self.assertEqual(repo.max_id_by_ref_id(), {None: 2, 1: 4, 3: 3})
+                self.assertEqual(repo.min_ref_id_by_name(), {'user1': 1, 'user2': None, 'user3': 1})
+                self.assertEqual(repo.group_count_by_ref_id(), {None: 1, 1: 2, 3: 1})
+                users[0].ref_id = 5
+                repo.save(users[0])
+                repo.remove(users[1])
+                repo.save(User(name='user4', ref_id=5))
+                self.assertEqual(repo.sum_ref_id(), 14)
+                self.assertEqual(repo.max_id_by_ref_id(), {1: 4, 3: 3, 5: 5})
+                self.assertEqual(repo.group_count_by_ref_id(), {1: 1, 3: 1, 5: 2})
+
+
+class TestAggregateFallback(unittest.TestCase):
+    def test_without_numpy(self):
+        repo = abc2db_memory(UserRepository)()
+        repo.save_all([User(name=f'user{i % 3}', ref_id=i % 4 or None) for i in range(10)])
+        repo.remove(repo.find(3))
+        names = ['sum_ref_id', 'avg_ref_id', 'max_id_by_ref_id', 'min_ref_id_by_name', 'group_count_by_ref_id']
+        vectorized = [getattr(repo, i)() for i in names]
+        with mock.patch.object(aggregate, 'numpy', None):
+            self.assertEqual([getattr(repo, i)() for i in names], vectorized)
+
+
+class TestTransaction(unittest.TestCase):
+    def setUp(self) -> None:
+        with open('users_transaction.json', 'w') as file:
+            file.write('{}')
+        self.repositories = [
+            abc2db_memory(UserRepository)(),
+            abc2db_memory(UserRepository)(compact=True),
+            abc2db_memory(UserRepository)(thread_safe=True),
+            abc2db_json(UserRepository)('users_transaction.json'),
+            abc2db_json(UserRepository)('users_transaction.json', journal=True)
+        ]
+
+    def tearDown(self) -> None:
+        for path in ('users_transaction.json', 'users_transaction.json.journal', 'users_transaction.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_commit(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                stale = repo.save(User(name='stale', ref_id=1))
+                with mock.patch.object(Json, '_save', autospec=True, side_effect=Json._save) as save:
+                    with repo.transaction():
+                        parent = repo.save(User(name='parent'))
+                        repo.save_all([User(name=f'child{i}', ref_id=parent.id) for i in range(3)])
+                        repo.remove(stale)
+                        self.assertEqual(len(repo.find_by_ref_id(parent.id)), 3)
+                        self.assertIsNone(repo.find(stale.id))
+                    if isinstance(repo, Json):
+                        self.assertEqual(save.call_count, 1)
+                self.assertEqual(len(repo.find_by_ref_id(parent.id)), 3)
+                repo.remove_all(repo.find_all())
+
+    def test_rollback(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                user1 = repo.save(User(name='user1', ref_id=1))
+                with self.assertRaises(RuntimeError):
+                    with repo.transaction():
+                        repo.save(User(name='user2', ref_id=1))
+                        repo.remove_by_ref_id(1)
+                        self.assertEqual(repo.find_all(), [])
+                        raise RuntimeError
+                self.assertEqual(repo.find_all(), [user1])
+                self.assertEqual(repo.find_by_ref_id(1), [user1])
+                repo.remove(user1)
+
+    def test_rollback_update(self):
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                user1 = repo.save(User(name='user1', ref_id=1))
+                with self.assertRaises(RuntimeError):
+                    with repo.transaction():
+                        user = repo.find(user1.id)
+                        user.name = 'changed'
+                        user.ref_id = 2
+                        repo.save(user)
+                        repo.save(User(name='user2'))
+                        raise RuntimeError
+                self.assertEqual(repo.find(user1.id).name, 'user1')
+                self.assertEqual([i.id for i in repo.find_by_ref_id(1)], [user1.id])
+                self.assertEqual(repo.find_by_ref_id(2), [])
+                self.assertEqual(repo.save(User(name='user3')).id, user1.id + 1)
+                repo.remove_all(repo.find_all())
+
+    def test_rollback_nested(self):
+        repo = abc2db_memory(EventRepository)()
+        event = repo.save(Event(at=datetime(2024, 5, 1), addr=Address(city='Oslo')))
+        with self.assertRaises(RuntimeError):
+            with repo.transaction():
+                event = repo.find(event.id)
+                event.addr.city = 'Rome'
+                repo.save(event)
+                raise RuntimeError
+        self.assertEqual(repo.find(event.id).addr.city, 'Oslo')
+
+
+class TestThreadSafeMemory(unittest.TestCase):
+    def test_stress(self):
+        repo = abc2db_memory(UserRepository)(thread_safe=True)
+        writers, readers, count = 4, 4, 500
+        ids = [[] for _ in range(writers)]
+        errors = []
+        done = threading.Event()
+
+        def write(out):
+            try:
+                for i in range(count):
+                    out.append(repo.save(User(name=f'user{i}', ref_id=i % 10)).id)
+                    if i % 50 == 0:
+                        repo.remove_by_ref_id_lte(-1)
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                while not done.is_set():
+                    for user in repo.find_by_ref_id(3):
+                        self.assertEqual(user.ref_id, 3)
+                    users = repo.find_all_sort_by_ref_id()
+                    self.assertEqual([i.ref_id for i in users], sorted(i.ref_id for i in users))
+                    repo.count_by_ref_id(5)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        threads += [threading.Thread(target=write, args=(i,)) for i in ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads[readers:]:
+            thread.join()
+        done.set()
+        for thread in threads[:readers]:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        saved = [i for out in ids for i in out]
+        self.assertEqual(sorted(saved), list(range(1, writers * count + 1)))
+        self.assertEqual(repo.count_all(), writers * count)
+        self.assertEqual(len(repo.find_by_ref_id(3)), writers * count // 10)
+
+    def test_write_excludes_readers(self):
+        repo = abc2db_memory(UserRepository)(thread_safe=True)
+        repo.save_all([User(name='user', ref_id=1) for _ in range(10)])
+        counts = []
+        with repo.transaction():
+            reader = threading.Thread(target=lambda: counts.append(repo.count_by_ref_id(1)))
+            reader.start()
+            repo.remove_by_ref_id(1)
+            reader.join(0.05)
+            self.assertTrue(reader.is_alive())
+            self.assertEqual(repo.count_by_ref_id(1), 0)
+            repo.save(User(name='user', ref_id=1))
+        reader.join()
+        self.assertEqual(counts, [1])
+
+
+class TestSnapshot(unittest.TestCase):
+    def tearDown(self) -> None:
+        for path in ('users.snapshot', 'users.snapshot.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_restore(self):
+        UserRepositoryMemory = abc2db_memory(UserRepository)
+        for codec in ('json', 'msgpack'):
+            for compact in (False, True):
+                with self.subTest(codec=codec, compact=compact):
+                    self.tearDown()
+                    repo = UserRepositoryMemory(snapshot='users.snapshot', snapshot_codec=codec)
+                    users = repo.save_all([User(name=f'user{i}', ref_id=i % 3) for i in range(10)])
+                    repo.remove(users[4])
+                    repo.close()
+
+                    restored = UserRepositoryMemory(compact=compact, snapshot='users.snapshot', snapshot_codec=codec)
+                    self.assertEqual(restored.count_by_ref_id(1), 2)
+                    if not compact:
+                        self.assertIsInstance(restored._base, MappedBase)
+                        self.assertEqual(sum(type(i) is int for i in restored._base._items.values()), 9)
+                    self.assertEqual(restored.find_all(), users[:4] + users[5:])
+                    self.assertEqual(restored.find_by_ref_id(1), [users[1], users[7]])
+                    self.assertEqual(restored.find_all_sort_by_ref_id_desc()[0].ref_id, 2)
+                    self.assertEqual(restored.save(User(name='new')).id, 11)
+
+    def test_resnapshot(self):
+        UserRepositoryMemory = abc2db_memory(UserRepository)
+        repo = UserRepositoryMemory(snapshot='users.snapshot')
+        users = repo.save_all([User(name=f'user{i}', ref_id=i) for i in range(5)])
+        repo.snapshot()
+
+        restored = UserRepositoryMemory(snapshot='users.snapshot')
+        restored.remove(users[0])
+        users[1].name = 'changed'
+        restored.save(users[1])
+        restored.snapshot(background=True).join()
+
+        restored = UserRepositoryMemory(snapshot='users.snapshot', snapshot_codec='msgpack')
+        self.assertEqual(restored.find_all(), users[1:])
+
+    def test_save_during_background(self):
+        UserRepositoryMemory = abc2db_memory(UserRepository)
+        repo = UserRepositoryMemory(snapshot='users.snapshot')
+        users = repo.save_all([User(name=f'user{i}', ref_id=1) for i in range(3)])
+        started, release = threading.Event(), threading.Event()
+
+        def write(*args):
+            started.set()
+            release.wait()
+            snapshot.write_snapshot(*args)
+
+        with mock.patch('abc2db.memory.write_snapshot', write):
+            thread = repo.snapshot(background=True)
+            started.wait()
+            users[0].ref_id = 2
+            repo.save(users[0])
+            release.set()
+            thread.join()
+
+        restored = UserRepositoryMemory(snapshot='users.snapshot')
+        self.assertEqual([i.ref_id for i in restored.find_by_ref_id(1)], [1, 1, 1])
+        self.assertEqual(restored.find_by_ref_id(2), [])
+
+    def test_periodic(self):
+        repo = abc2db_memory(UserRepository)(snapshot='users.snapshot', snapshot_interval=0.01)
+        repo.save(User(name='user1'))
+        for _ in range(100):
+            if os.path.exists('users.snapshot'):
+                break
+            time.sleep(0.01)
+        repo.save(User(name='user2'))
+        repo.close()
+        self.assertEqual(len(abc2db_memory(UserRepository)(snapshot='users.snapshot').find_all()), 2)
+
+    def test_nested_model(self):
+        EventRepositoryMemory = abc2db_memory(EventRepository)
+        for codec in ('json', 'msgpack', 'pickle'):
+            with self.subTest(codec=codec):
+                self.tearDown()
+                repo = EventRepositoryMemory(snapshot='users.snapshot', snapshot_codec=codec)
+                first = repo.save(Event(at=datetime(2024, 5, 1, 12), addr=Address(city='Oslo'), ref_id=1))
+                second = repo.save(Event(at=datetime(2023, 1, 1), addr=Address(city='Rome'), ref_id=1))
+                repo.close()
+
+                restored = EventRepositoryMemory(snapshot='users.snapshot', snapshot_codec=codec)
+                self.assertIsInstance(restored.find(1).addr, Address)
+                self.assertEqual(restored.find(1), first)
+                self.assertEqual(restored.find_all_sort_by_at(), [second, first])
+                self.assertEqual(restored.find_by_ref_id(1), [first, second])
+
+    def test_periodic_error(self):
+        repo = abc2db_memory(UserRepository)(snapshot='users.snapshot')
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise OSError('disk full')
+
+        with mock.patch.object(repo, 'snapshot', fail), self.assertWarns(RuntimeWarning):
+            thread = threading.Thread(target=repo._periodic, args=(0.001,))
+            thread.start()
+            while len(calls) < 2:
+                time.sleep(0.001)
+            repo._snapshot_stop.set()
+            thread.join()
+
+    def test_schema_mismatch(self):
+        repo = abc2db_memory(UserRepository)(snapshot='users.snapshot')
+        repo.save(User(name='user1'))
+        repo.close()
+
+        class Other(BaseModel):
+            id: int | None
+
+        class OtherRepository(ABC):
+            def find(self, _id) -> Other:
+                ...
+
+        with self.assertRaises(ValueError):
+            abc2db_memory(OtherRepository)(snapshot='users.snapshot')
+
+
+class TestMmap(unittest.TestCase):
+    def setUp(self) -> None:
+        with open('users_mmap.json', 'w') as file:
+            file.write('{}')
+        source = abc2db_json(UserRepository)('users_mmap.json')
+        self.memory = abc2db_memory(UserRepository)()
+        for i in range(40):
+            user = User(name=f'user{i % 7}', ref_id=None if i % 9 == 0 else i % 5)
+            source.save(user)
+            self.memory.save(user.copy())
+        source.remove(source.find(13))
+        self.memory.remove(self.memory.find(13))
+
+    def tearDown(self) -> None:
+        for path in ('users_mmap.json', 'users_mmap.json.meta', 'users.mmap', 'users.mmap.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_queries(self):
+        for codec in ('json', 'msgpack'):
+            with self.subTest(codec=codec):
+                build_mmap(UserRepository, 'users_mmap.json', 'users.mmap', codec=codec)
+                repo = abc2db_mmap(UserRepository)('users.mmap')
+                memory = self.memory
+                self.assertEqual(repo.find(5), memory.find(5))
+                self.assertIsNone(repo.find(13))
+                self.assertIsNone(repo.find(100))
+                for name in ('find_all', 'find_all_sort_by_id_desc', 'find_all_sort_by_ref_id',
+                             'find_all_sort_by_ref_id_desc', 'count_all', 'sum_ref_id', 'max_id_by_ref_id',
+                             'group_count_by_ref_id'):
+                    self.assertEqual(getattr(repo, name)(), getattr(memory, name)(), name)
+                for ref_id in (None, 0, 3, 7):
+                    for name in ('find_by_ref_id', 'find_by_ref_id_sort_by_id_desc', 'count_by_ref_id'):
+                        self.assertEqual(getattr(repo, name)(ref_id), getattr(memory, name)(ref_id), name)
+                    self.assertEqual(repo.find_by_ref_id_in([ref_id, 1]), memory.find_by_ref_id_in([ref_id, 1]))
+                for ref_id in (-1, 0, 3, 7):
+                    self.assertEqual(repo.find_by_ref_id_gt_sort_by_ref_id(ref_id),
+                                     memory.find_by_ref_id_gt_sort_by_ref_id(ref_id))
+                self.assertEqual(repo.find_by_ref_id_and_name(1, 'user1'), memory.find_by_ref_id_and_name(1, 'user1'))
+                self.assertEqual(repo.find_by_ref_id_between_and_name_in(1, 3, ['user2', 'user3']),
+                                 memory.find_by_ref_id_between_and_name_in(1, 3, ['user2', 'user3']))
+                self.assertEqual(repo.count_by_ref_id_gte_and_name(2, 'user4'),
+                                 memory.count_by_ref_id_gte_and_name(2, 'user4'))
+                self.assertEqual(repo.exists_by_name('user6'), True)
+                self.assertEqual(repo.exists_by_name('nobody'), False)
+                self.assertEqual(repo.find_all_sort_by_id_limit_2(3), memory.find_all_sort_by_id_limit_2(3))
+                page = repo.find_all_sort_by_ref_id_page(5)
+                self.assertEqual(page, memory.find_all_sort_by_ref_id_page(5))
+                self.assertEqual(repo.find_all_sort_by_ref_id_page(5, page[-1]),
+                                 memory.find_all_sort_by_ref_id_page(5, page[-1]))
+                self.assertEqual(repo.find_all_sort_by_ref_id_desc_page_2(page[-1]),
+                                 memory.find_all_sort_by_ref_id_desc_page_2(page[-1]))
+                self.assertEqual(list(repo.find_all_sort_by_ref_id_limit_iter(4, 2)),
+                                 list(memory.find_all_sort_by_ref_id_limit_iter(4, 2)))
+
+    def test_nested_model(self):
+        EventRepositoryMmap = abc2db_mmap(EventRepository)
+        first = Event(id=1, at=datetime(2024, 5, 1, 12), addr=Address(city='Oslo'), ref_id=1)
+        second = Event(id=2, at=datetime(2023, 1, 1), addr=Address(city='Rome'), ref_id=1)
+        for codec in ('json', 'msgpack'):
+            with self.subTest(codec=codec):
+                write_mmap('users.mmap', Event, [first, second], EventRepositoryMmap._index_keys,
+                           EventRepositoryMmap._sort_keys, codec)
+                repo = EventRepositoryMmap('users.mmap')
+                self.assertIsInstance(repo.find(1).addr, Address)
+                self.assertEqual(repo.find(1), first)
+                self.assertEqual(repo.find_all_sort_by_at(), [second, first])
+                self.assertEqual(repo._sort_indexes['at'].range('gt', (datetime(2023, 6, 1),)), [1])
+                self.assertEqual(repo.find_by_ref_id(1), [first, second])
+
+    def test_read_only(self):
+        build_mmap(UserRepository, 'users_mmap.json', 'users.mmap')
+        repo = abc2db_mmap(UserRepository)('users.mmap')
+        for meth, args in ((repo.save, (User(name='user'),)), (repo.remove, (repo.find(1),)),
+                           (repo.remove_by_ref_id, (1,)), (repo.save_all, ([],))):
+            with self.assertRaises(TypeError):
+                meth(*args)
+        self.assertEqual(repo.count_all(), 39)
+
+    def test_schema_mismatch(self):
+        build_mmap(UserRepository, 'users_mmap.json', 'users.mmap')
+
+        class Other(BaseModel):
+            id: int | None
+
+        class OtherRepository(ABC):
+            def find(self, _id) -> Other:
+                ...
+
+        with self.assertRaises(ValueError):
+            abc2db_mmap(OtherRepository)('users.mmap')
+
+
+class TestCached(unittest.TestCase):
+    def setUp(self) -> None:
+        with open('users_cached.json', 'w') as file:
+            file.write('{}')
+        self.UserRepositoryCached = abc2db_cached(UserRepository, abc2db_json, max_items=4, ttl=60)
+        self.repo = self.UserRepositoryCached('users_cached.json')
+
+    def tearDown(self) -> None:
+        for path in ('users_cached.json', 'users_cached.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_hit(self):
+        user1, user2 = self.repo.save_all([User(name='user1', ref_id=1), User(name='user2', ref_id=2)])
+        self.assertEqual(self.repo.find_by_ref_id(1), [user1])
+        with mock.patch.object(Json, '_find_by', autospec=True) as find_by:
+            self.assertEqual(self.repo.find_by_ref_id(1), [user1])
+        find_by.assert_not_called()
+        self.assertEqual(self.repo.find(2), user2)
+        self.assertEqual(self.repo.find(2), user2)
+        self.assertEqual((self.repo.cache.hits, self.repo.cache.misses), (2, 2))
+
+    def test_invalidate(self):
+        user1, user2 = self.repo.save_all([User(name='user1', ref_id=1), User(name='user2', ref_id=2)])
+        self.assertEqual(self.repo.find_by_ref_id(1), [user1])
+        self.assertEqual(self.repo.find_by_ref_id(2), [user2])
+        self.assertEqual(self.repo.find(1), user1)
+        user2.name = 'user3'
+        self.repo.save(user2)
+        self.assertEqual(len(self.repo.cache), 2)
+        user3 = self.repo.save(User(name='user4', ref_id=1))
+        self.assertEqual(self.repo.find_by_ref_id(1), [user1, user3])
+        user1.ref_id = 2
+        self.repo.save(user1)
+        self.assertEqual(self.repo.find_by_ref_id(1), [user3])
+        self.assertEqual(self.repo.find(1).ref_id, 2)
+        self.repo.remove(user3)
+        self.assertEqual(self.repo.find_by_ref_id(1), [])
+        self.assertEqual(self.repo.remove_by_ref_id(2), [user1, user2])
+        self.assertEqual(self.repo.find_all(), [])
+
+    def test_invalidate_offset(self):
+        user1, user2, user3 = self.repo.save_all([User(name=f'user{i}', ref_id=1) for i in range(3)])
+        self.assertEqual(self.repo.find_by_ref_id_sort_by_id_desc_limit(1, 1, 1), [user2])
+        user3.ref_id = 2
+        self.repo.save(user3)
+        self.assertEqual(self.repo.find_by_ref_id_sort_by_id_desc_limit(1, 1, 1), [user1])
+
+    def test_write_during_read(self):
+        find_by = Json._find_by
+        written = []
+
+        def racing(repo, *args):
+            result = find_by(repo, *args)
+            if not written:
+                written.append(repo.save(User(name='user2', ref_id=1)))
+            return result
+
+        with mock.patch.object(Json, '_find_by', racing):
+            repo = abc2db_cached(UserRepository, abc2db_json)('users_cached.json')
+        user1 = repo.save(User(name='user1', ref_id=1))
+        self.assertEqual(repo.find_by_ref_id(1), [user1])
+        self.assertEqual(repo.find_by_ref_id(1), [user1] + written)
+
+    def test_eviction(self):
+        self.repo.save_all([User(name=f'user{i}', ref_id=i) for i in range(6)])
+        for i in range(6):
+            self.repo.find_by_ref_id(i)
+        self.assertEqual((len(self.repo.cache), self.repo.cache.evictions), (4, 2))
+        with mock.patch('abc2db.cache.monotonic', return_value=time.monotonic() + 61):
+            self.repo.find_by_ref_id(5)
+        self.assertEqual(self.repo.cache.evictions, 3)
+
+    def test_transaction_rollback(self):
+        user1 = self.repo.save(User(name='user1', ref_id=1))
+        with self.assertRaises(RuntimeError):
+            with self.repo.transaction():
+                self.repo.remove(user1)
+                self.assertEqual(self.repo.find_by_ref_id(1), [])
+                raise RuntimeError
+        self.assertEqual(self.repo.find_by_ref_id(1), [user1])
+
+
+class TestBuild(unittest.TestCase):
+    def test_unknown_field(self):
+        class BrokenRepository(ABC):
+            @abstractmethod
+            def find(self, _id) -> User:
+                ...
+
+            @abstractmethod
+            def find_by_refid(self, ref_id: int) -> list[User]:
+                ...
+
+        for factory in (abc2db_memory, abc2db_json):
+            with self.subTest(msg=factory.__name__):
+                with self.assertRaises(ValueError):
+                    factory(BrokenRepository)
+
+    def test_unhashable_field(self):
+        class Tagged(BaseModel):
+            id: int | None
+            tags: list[str]
+
+        class TaggedRepository(ABC):
+            def find(self, _id) -> Tagged:
+                ...
+
+            def save(self, tagged: Tagged) -> Tagged:
+                ...
+
+            def find_by_tags(self, tags: list[str]) -> list[Tagged]:
+                ...
+
+        TaggedRepositoryMemory = abc2db_memory(TaggedRepository)
+        self.assertEqual(TaggedRepositoryMemory._index_keys, ())
+        for repo in (TaggedRepositoryMemory(), TaggedRepositoryMemory(compact=True)):
+            with self.subTest(msg=f'{type(repo._base)}'):
+                first = repo.save(Tagged(tags=['a', 'b']))
+                repo.save(Tagged(tags=['c']))
+                self.assertEqual(repo.find_by_tags(['a', 'b']), [first])
+
+    def test_suffix_field_names(self):
+        class Page(BaseModel):
+            id: int | None
+            page: int
+            desc: str = ''
+
+        class PageRepository(ABC):
+            def find(self, _id) -> Page:
+                ...
+
+            def save(self, page: Page) -> Page:
+                ...
+
+            def save_all(self, pages: list[Page]) -> list[Page]:
+                ...
+
+            def find_by_page(self, page: int) -> list[Page]:
+                ...
+
+            def find_all_sort_by_page(self) -> list[Page]:
+                ...
+
+            def find_all_sort_by_desc_desc(self) -> list[Page]:
+                ...
+
+            def find_all_sort_by_page_limit_1(self, offset: int = 0) -> list[Page]:
+                ...
+
+            def find_all_pages(self) -> list[Page]:
+                ...
+
+        with self.assertRaises(ValueError):
+            abc2db_memory(PageRepository)
+        del PageRepository.find_all_pages
+        repo = abc2db_memory(PageRepository)()
+        first, second = repo.save_all([Page(page=2, desc='a'), Page(page=1, desc='b')])
+        self.assertEqual(repo.find_by_page(2), [first])
+        self.assertEqual(repo.find_all_sort_by_page(), [second, first])
+        self.assertEqual(repo.find_all_sort_by_desc_desc(), [second, first])
+        self.assertEqual(repo.find_all_sort_by_page_limit_1(1), [first])
+
+
+class TestJsonCache(unittest.TestCase):
+    def setUp(self) -> None:
+        with open('users_cache.json', 'w') as file:
+            file.write('{"1": {"id": 1, "name": "user1", "ref_id": null}}')
+        self.UserRepositoryJson = abc2db_json(UserRepository)
+
+    def tearDown(self) -> None:
+        for path in ('users_cache.json', 'users_cache.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_cached(self):
+        repo = self.UserRepositoryJson('users_cache.json')
+        self.assertIs(repo.find(1), repo.find(1))
+
+    def test_strict(self):
+        repo = self.UserRepositoryJson('users_cache.json', strict=True)
+        self.assertIsNot(repo.find(1), repo.find(1))
+        self.assertEqual(repo.find(1), repo.find(1))
+
+    def test_aliasing(self):
+        for strict in (False, True):
+            with self.subTest(strict=strict):
+                self.setUp()
+                repo = self.UserRepositoryJson('users_cache.json', strict=strict)
+                repo.find(1).name = 'changed'
+                repo.save(User(name='user2'))
+                other = self.UserRepositoryJson('users_cache.json', strict=True)
+                self.assertEqual(other.find(1).name, 'user1' if strict else 'changed')
+
+    def test_reload_on_change(self):
+        repo = self.UserRepositoryJson('users_cache.json')
+        other = self.UserRepositoryJson('users_cache.json')
+        self.assertEqual(repo.find(1).name, 'user1')
+        other.save(User(name='user2'))
+        self.assertEqual(repo.find(2).name, 'user2')
+        self.assertEqual(repo.save(User(name='user3')).id, 3)
+
+    def test_save_all_single_pass(self):
+        repo = self.UserRepositoryJson('users_cache.json')
+        with mock.patch.object(repo, '_save', wraps=repo._save) as save:
+            repo.save_all([User(name=f'user{i}') for i in range(10)])
+            repo.remove_all(repo.find_all()[:5])
+        self.assertEqual(save.call_count, 2)
+        self.assertEqual(len(self.UserRepositoryJson('users_cache.json').find_all()), 6)
+
+    def test_lazy_parse(self):
+        repo = self.UserRepositoryJson('users_cache.json')
+        repo.save_all([User(name=f'user{i}') for i in range(10)])
+        os.remove('users_cache.json.meta')
+        repo = self.UserRepositoryJson('users_cache.json')
+        with mock.patch.object(User, 'parse_obj', wraps=User.parse_obj) as parse_obj:
+            self.assertEqual(repo.find(3).name, 'user1')
+            self.assertEqual(repo.count_all(), 11)
+            repo.save(User(name='user11'))
+            self.assertEqual(parse_obj.call_count, 1)
+            self.assertIs(repo.find(3), repo.find(3))
+            self.assertEqual(parse_obj.call_count, 1)
+        self.assertEqual(len(self.UserRepositoryJson('users_cache.json').find_all()), 12)
+
+    def test_count_raw(self):
+        repo = self.UserRepositoryJson('users_cache.json')
+        repo.save_all([User(name=f'user{i}', ref_id=i % 3) for i in range(10)])
+        repo = self.UserRepositoryJson('users_cache.json')
+        with mock.patch.object(User, 'parse_obj') as parse_obj, mock.patch.object(User, 'construct') as construct:
+            self.assertEqual(repo.count_by_ref_id(1), 3)
+            self.assertEqual(repo.count_by_ref_id_gte_and_name(1, 'user2'), 1)
+            self.assertTrue(repo.exists_by_name('user9'))
+            self.assertFalse(repo.exists_by_name('user10'))
+        parse_obj.assert_not_called()
+        construct.assert_not_called()
+        repo.find(2).ref_id = 1
+        self.assertEqual(repo.count_by_ref_id(1), 4)
+
+    def test_meta(self):
+        repo = self.UserRepositoryJson('users_cache.json')
+        user2, user3 = repo.save_all([User(name='user2'), User(name='user3')])
+        repo.remove(user3)
+        with mock.patch.object(User, 'parse_obj') as parse_obj:
+            other = self.UserRepositoryJson('users_cache.json')
+            self.assertEqual(other.find(2), user2)
+            self.assertEqual(other.save(User(name='user4')).id, 4)
+        parse_obj.assert_not_called()
+        with open('users_cache.json', 'w') as file:
+            file.write('{"1": {"id": 1, "name": "user1", "ref_id": null}}')
+        self.assertEqual(self.UserRepositoryJson('users_cache.json').save(User(name='user2')).id, 2)
+
+    def test_remove_missing(self):
+        repo = self.UserRepositoryJson('users_cache.json')
+        user1 = repo.find(1)
+        with self.assertRaises(KeyError):
+            repo.remove_all([user1, User(id=10, name='user10')])
+        repo.save(User(name='user2'))
+        self.assertEqual([i.id for i in self.UserRepositoryJson('users_cache.json').find_all()], [1, 2])
+
+    def test_trusted(self):
+        repo = self.UserRepositoryJson('users_cache.json', trusted=True)
+        with mock.patch.object(User, 'parse_obj') as parse_obj:
+            self.assertEqual(repo.find(1), User(id=1, name='user1'))
+        parse_obj.assert_not_called()
+
+
+class TestJsonCodec(unittest.TestCase):
+    def setUp(self) -> None:
+        with open('users_codec.json', 'w') as file:
+            file.write('{"1": {"id": 1, "name": "user1", "ref_id": null}}')
+        self.UserRepositoryJson = abc2db_json(UserRepository)
+
+    def tearDown(self) -> None:
+        for path in ('users_codec.json', 'users_codec.json.journal', 'users_codec.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_codecs(self):
+        for name, module in (('json', True), ('orjson', codecs.orjson), ('msgpack', codecs.msgpack), ('pickle', True)):
+            if module is None:
+                continue
+            with self.subTest(msg=name):
+                repo = self.UserRepositoryJson('users_codec.json', codec=name)
+                repo.save(User(name='user2', ref_id=1))
+                if codecs.CODECS[name].magic:
+                    with open('users_codec.json', 'rb') as file:
+                        self.assertTrue(file.read().startswith(codecs.CODECS[name].magic))
+                other = self.UserRepositoryJson('users_codec.json', codec=name, journal=True)
+                other.save(User(name='user3'))
+                other.compact()
+                self.assertEqual([i.name for i in self.UserRepositoryJson('users_codec.json', codec=name).find_all()],
+                                 ['user1', 'user2', 'user3'])
+                repo.remove_all(repo.find_all()[1:])
+
+    def test_detect(self):
+        if codecs.msgpack is None:
+            self.skipTest('msgpack is not installed')
+        self.UserRepositoryJson('users_codec.json', codec='msgpack').save(User(name='user2'))
+        self.assertEqual(len(self.UserRepositoryJson('users_codec.json').find_all()), 2)
+
+    def test_pickle_requires_codec(self):
+        self.UserRepositoryJson('users_codec.json', codec='pickle').save(User(name='user2'))
+        with self.assertRaises(ValueError):
+            self.UserRepositoryJson('users_codec.json').find(1)
+
+
+class TestJsonMultiprocess(unittest.TestCase):
+    def setUp(self) -> None:
+        with open('users_multiprocess.json', 'w') as file:
+            file.write('{}')
+        self.UserRepositoryJson = abc2db_json(UserRepository)
+
+    def tearDown(self) -> None:
+        for path in ('users_multiprocess.json', 'users_multiprocess.json.meta', 'users_multiprocess.json.lock'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_concurrent_writers(self):
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=save_users, args=('users_multiprocess.json', 50)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        users = self.UserRepositoryJson('users_multiprocess.json', multiprocess=True).find_all()
+        self.assertEqual([i.id for i in users], list(range(1, 201)))
+        self.assertEqual(sorted({i.ref_id for i in users}), sorted(i.pid for i in processes))
+
+    def test_reload_on_change(self):
+        repo = self.UserRepositoryJson('users_multiprocess.json', multiprocess=True)
+        other = self.UserRepositoryJson('users_multiprocess.json', multiprocess=True)
+        user1 = repo.save(User(name='user1'))
+        self.assertEqual(other.find_all(), [user1])
+        with mock.patch('abc2db.json.decode', side_effect=codecs.decode) as decode:
+            repo.find_all()
+            other.find_all()
+            self.assertEqual(decode.call_count, 0)
+            user2 = other.save(User(name='user2'))
+            self.assertEqual(user2.id, 2)
+            self.assertEqual(decode.call_count, 0)
+            self.assertEqual(repo.find_all(), [user1, user2])
+            self.assertEqual(decode.call_count, 1)
+
+    def test_transaction(self):
+        repo = self.UserRepositoryJson('users_multiprocess.json', multiprocess=True)
+        other = self.UserRepositoryJson('users_multiprocess.json', multiprocess=True)
+        with repo.transaction():
+            repo.save(User(name='user1'))
+            self.assertEqual(repo._lock_depth, 1)
+        self.assertIsNone(repo._lock_file)
+        self.assertEqual(len(other.find_all()), 1)
+        with self.assertRaises(RuntimeError):
+            with repo.transaction():
+                repo.save(User(name='user2'))
+                raise RuntimeError
+        self.assertIsNone(repo._lock_file)
+        self.assertEqual(len(other.find_all()), 1)
+
+    def test_journal_rejected(self):
+        with self.assertRaises(ValueError):
+            self.UserRepositoryJson('users_multiprocess.json', multiprocess=True, journal=True)
+
+
+class TestJsonJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        with open('users_journal.json', 'w') as file:
+            file.write('{}')
+        self.UserRepositoryJson = abc2db_json(UserRepository)
+
+    def tearDown(self) -> None:
+        for path in ('users_journal.json', 'users_journal.json.journal', 'users_journal.json.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_replay(self):
+        repo = self.UserRepositoryJson('users_journal.json', journal=True)
+        user1, user2 = repo.save_all([User(name='user1', ref_id=1), User(name='user2', ref_id=1)])
+        user1.name = 'user3'
+        repo.save(user1)
+        repo.remove(user2)
+        with open('users_journal.json') as file:
+            self.assertEqual(file.read(), '{}')
+
+        other = self.UserRepositoryJson('users_journal.json', journal=True)
+        self.assertEqual(other.find_all(), [user1])
+
+    def test_compact(self):
+        repo = self.UserRepositoryJson('users_journal.json', journal=True)
+        user1, user2 = repo.save_all([User(name='user1'), User(name='user2')])
+        repo.remove(user1)
+        repo.compact()
+        self.assertEqual(os.path.getsize('users_journal.json.journal'), 0)
+        self.assertEqual(self.UserRepositoryJson('users_journal.json').find_all(), [user2])
+        self.assertEqual(repo.find_all(), [user2])
+
+    def test_background_compact(self):
+        repo = self.UserRepositoryJson('users_journal.json', journal=True, compact_size=0, compact_ratio=None)
+        repo.save_all([User(name=f'user{i}') for i in range(20)])
+        repo._compaction.join()
+        repo.compact()
+        self.assertEqual(os.path.getsize('users_journal.json.journal'), 0)
+        self.assertEqual(len(self.UserRepositoryJson('users_journal.json').find_all()), 20)
+        self.assertEqual(len(repo.find_all()), 20)
+
+    def test_monotonic_id(self):
+        repo = self.UserRepositoryJson('users_journal.json', journal=True)
+        user1, user2 = repo.save_all([User(name='user1'), User(name='user2')])
+        repo.remove(user2)
+        self.assertEqual(self.UserRepositoryJson('users_journal.json', journal=True).save(User(name='user3')).id, 3)
+        repo.compact()
+        self.assertEqual(self.UserRepositoryJson('users_journal.json', journal=True).save(User(name='user4')).id, 4)
+
+    def test_torn_record(self):
+        repo = self.UserRepositoryJson('users_journal.json', journal=True)
+        user1 = repo.save(User(name='user1'))
+        with open('users_journal.json.journal', 'a') as file:
+            file.write('{"op": "upsert", "id": 2, "da')
+
+        other = self.UserRepositoryJson('users_journal.json', journal=True)
+        self.assertEqual(other.find_all(), [user1])
+        user2 = other.save(User(name='user2'))
+        self.assertEqual(self.UserRepositoryJson('users_journal.json', journal=True).find_all(), [user1, user2])
+
+
+class TestShardedJson(unittest.TestCase):
+    def setUp(self) -> None:
+        shutil.rmtree('users_shards', ignore_errors=True)
+        self.repo = abc2db_sharded_json(UserRepository)('users_shards', shards=4)
+
+    def tearDown(self) -> None:
+        self.repo.close()
+        shutil.rmtree('users_shards')
+
+    def test_layout(self):
+        self.repo.save_all([User(name=f'user{i}') for i in range(8)])
+        self.assertEqual(sorted(i for i in os.listdir('users_shards') if i.endswith('.json')),
+                         [f'shard_{i}.json' for i in range(4)])
+        with mock.patch.object(Json, '_save', autospec=True, side_effect=Json._save) as save:
+            self.repo.save(self.repo.find(6))
+        self.assertEqual([i.args[0] for i in save.call_args_list], [self.repo._shards[2]])
+
+    def test_reopen(self):
+        self.repo.save_all([User(name=f'user{i}', ref_id=i % 2) for i in range(8)])
+        repo = abc2db_sharded_json(UserRepository)('users_shards', shards=4)
+        self.assertEqual([i.id for i in repo.find_by_ref_id(1)], [2, 4, 6, 8])
+        self.assertEqual(repo.save(User(name='user8')).id, 9)
+        repo.close()
+
+    def test_remove_all_missing(self):
+        users = self.repo.save_all([User(name=f'user{i}') for i in range(4)])
+        with self.assertRaises(KeyError):
+            self.repo.remove_all([users[0], User(id=10, name='user10')])
+        self.assertEqual(self.repo.find_all(), users)
+
+    def test_shard_count_mismatch(self):
+        self.repo.save_all([User(name=f'user{i}') for i in range(8)])
+        with self.assertRaises(ValueError):
+            abc2db_sharded_json(UserRepository)('users_shards', shards=3)
+
+    def test_insert_touches_one_shard(self):
+        self.repo.save_all([User(name=f'user{i}') for i in range(8)])
+        with mock.patch.object(Json, '_load', autospec=True, side_effect=Json._load) as load:
+            self.assertEqual(self.repo.save(User(name='user8')).id, 9)
+        self.assertEqual({i.args[0] for i in load.call_args_list}, {self.repo._shards[1]})
+        self.assertEqual(self.repo.save(User(id=20, name='user20')).id, 20)
+        self.assertEqual(self.repo.save(User(name='user21')).id, 21)
+
+
+class TestSqlite(unittest.TestCase):
+    def setUp(self) -> None:
+        self.UserRepositorySqlite = abc2db_sqlite(UserRepository)
+        self.repo = self.UserRepositorySqlite('users_sqlite.db')
+
+    def tearDown(self) -> None:
+        self.repo.close()
+        for path in ('users_sqlite.db', 'users_sqlite.db-wal', 'users_sqlite.db-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_persist(self):
+        users = self.repo.save_all([User(name='user1', ref_id=1), User(name='user2')])
+        other = self.UserRepositorySqlite('users_sqlite.db')
+        self.assertEqual(other.find_all(), users)
+        other.close()
+
+    def test_schema(self):
+        connection = self.repo._connection
+        self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+        indexes = {i[1] for i in connection.execute('PRAGMA index_list("user")')}
+        self.assertEqual(indexes, {'user_ref_id', 'user_name'})
+        plan = connection.execute('EXPLAIN QUERY PLAN SELECT * FROM "user" WHERE "ref_id" IS ?', (1,)).fetchall()
+        self.assertIn('user_ref_id', plan[0][3])
+
+    def test_ids_not_reused(self):
+        user1, user2 = self.repo.save_all([User(name='user1'), User(name='user2')])
+        self.repo.remove(user2)
+        self.assertEqual(self.repo.save(User(name='user3')).id, 3)
+        self.repo.save(User(id=10, name='user10'))
+        self.repo.remove_all(self.repo.find_all())
+        self.assertEqual(self.repo.save(User(name='user11')).id, 11)
+
+    def test_remove_missing(self):
+        user1 = self.repo.save(User(name='user1'))
+        with self.assertRaises(KeyError):
+            self.repo.remove_all([user1, User(id=10, name='user10')])
+        self.assertEqual(self.repo.find_all(), [user1])
+
+
+class TestJsonFields(unittest.TestCase):
+    def setUp(self) -> None:
+        with open('events.json', 'w') as file:
+            file.write('{}')
+        self.repositories = [
+            abc2db_memory(EventRepository)(),
+            abc2db_json(EventRepository)('events.json', codec='pickle'),
+            abc2db_sqlite(EventRepository)('events.db')
+        ]
+
+    def tearDown(self) -> None:
+        self.repositories[-1].close()
+        for path in ('events.json', 'events.json.meta', 'events.db', 'events.db-wal', 'events.db-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_predicates(self):
+        first = Event(at=datetime(2024, 5, 1, 12), addr=Address(city='Oslo'))
+        second = Event(at=datetime(2023, 1, 1), addr=Address(city='Rome'))
+        for repo in self.repositories:
+            with self.subTest(msg=f'{type(repo)}'):
+                repo.save(first)
+                repo.save(second)
+                self.assertEqual(repo.find_by_at(datetime(2024, 5, 1, 12)), [first])
+                self.assertEqual(repo.count_by_at(datetime(2023, 1, 1)), 1)
+                self.assertEqual(repo.count_by_at(datetime(2022, 1, 1)), 0)
+                self.assertEqual(repo.find_by_addr_in([Address(city='Rome'), Address(city='Oslo')]), [first, second])
+                self.assertEqual(repo.find_by_addr_in([Address(city='Paris')]), [])
+
+    def test_sqlite_range(self):
+        class RangeRepository(ABC):
+            def find(self, _id) -> Event:
+                ...
+
+            def find_by_at_gt(self, at: datetime) -> list[Event]:
+                ...
+
+        with self.assertRaises(ValueError):
+            abc2db_sqlite(RangeRepository)
+        self.assertEqual(abc2db_memory(RangeRepository)().find_by_at_gt(datetime(2023, 1, 1)), [])